@@ -0,0 +1,280 @@
+"""Caching for query results that only change when the data is reloaded"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+try:
+    import redis.asyncio as redis
+    from redis.exceptions import RedisError
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    value: Any
+    etag: str
+    last_modified: float
+    expires: float
+
+
+def _etag(value: Any) -> str:
+    digest = hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+class TTLCache:
+    """
+    Cache results for `ttl` seconds, or until `invalidate()` is called.
+
+    Each entry carries an ETag derived from its value and the time that value
+    was first seen, so HTTP responses can be revalidated cheaply.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[Hashable, CacheEntry] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.expires < time.time():
+            return None
+        return entry
+
+    def set(self, key: Hashable, value: Any) -> CacheEntry:
+        now = time.time()
+        etag = _etag(value)
+        with self._lock:
+            previous = self._entries.get(key)
+            # An unchanged value keeps its original Last-Modified time
+            last_modified = previous.last_modified if previous and previous.etag == etag else now
+            entry = CacheEntry(value, etag, last_modified, now + self.ttl)
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def cached(self, fn: Callable) -> Callable:
+        """
+        Decorate a db helper taking a session as its first argument.
+
+        The session is not part of the cache key. Calling the wrapper returns
+        the value; `wrapper.entry(db, ...)` returns the whole CacheEntry.
+        """
+
+        def entry(db, *args) -> CacheEntry:
+            key = (fn.__name__, args)
+            cached = self.get(key)
+            if cached is None:
+                cached = self.set(key, fn(db, *args))
+            return cached
+
+        @wraps(fn)
+        def wrapper(db, *args):
+            return entry(db, *args).value
+
+        wrapper.entry = entry
+        return wrapper
+
+
+
+
+def cache_key(*parts: Any) -> str:
+    """Digest of `parts`, which must have a stable repr (e.g. EventFilters, tuples, strings)"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+class LRUCache:
+    """
+    Keep byte strings for `ttl` seconds in this process, up to `max_bytes` in total.
+
+    The least recently used entries are evicted first. Methods are async to
+    match RedisCache.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[str, Tuple[bytes, float]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    async def clear(self) -> bool:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        return True
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._size -= len(value)
+
+
+class RedisCache:
+    """
+    Keep byte strings for `ttl` seconds in Redis, shared by every worker and replica of the app.
+
+    Set a maxmemory limit with an LRU eviction policy on the Redis server to bound its size.
+    The cache fails open: when Redis cannot be reached, reads miss and writes are dropped.
+    """
+
+    def __init__(self, url: str, ttl: float, prefix: str):
+        if redis is None:
+            raise RuntimeError("The redis package is required to use a Redis cache")
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            return await self.client.get(f"{self.prefix}:{key}")
+        except RedisError as e:
+            logger.warning("Redis cache read failed, treating as a miss: %s", e)
+            return None
+
+    async def set(self, key: str, value: bytes):
+        try:
+            await self.client.set(f"{self.prefix}:{key}", value, ex=max(1, int(self.ttl)))
+        except RedisError as e:
+            logger.warning("Redis cache write failed, not caching: %s", e)
+
+    async def clear(self) -> bool:
+        """Delete every entry. Returns False, leaving some entries to expire, if Redis could not be reached."""
+        batch = []
+        try:
+            async for key in self.client.scan_iter(match=f"{self.prefix}:*", count=1000):
+                batch.append(key)
+                if len(batch) == 1000:
+                    await self.client.unlink(*batch)
+                    batch = []
+            if batch:
+                await self.client.unlink(*batch)
+        except RedisError as e:
+            logger.warning("Redis cache clear failed, entries expire after the TTL: %s", e)
+            return False
+        return True
+
+
+# The generation before SharedGeneration first reads it, distinct from a missing counter
+_UNSEEN = object()
+
+
+class SharedGeneration:
+    """
+    A counter in Redis that is bumped to invalidate a TTLCache in every worker and replica.
+
+    `check()` compares the counter with the value last seen by this process, at
+    most every `interval` seconds, and invalidates `cache` when it has moved.
+    Like RedisCache it fails open: when Redis cannot be reached the local cache
+    is kept until it expires.
+    """
+
+    def __init__(self, url: str, key: str, cache: TTLCache, interval: float = 1.0):
+        if redis is None:
+            raise RuntimeError("The redis package is required to share cache invalidation")
+        self.client = redis.from_url(url)
+        self.key = key
+        self.cache = cache
+        self.interval = interval
+        self._seen: Any = _UNSEEN
+        self._checked = 0.0
+
+    async def check(self):
+        now = time.monotonic()
+        if now - self._checked < self.interval:
+            return
+        self._checked = now
+        try:
+            generation = await self.client.get(self.key)
+        except RedisError as e:
+            logger.warning("Reading the cache generation failed: %s", e)
+            return
+        if generation != self._seen:
+            if self._seen is not _UNSEEN:
+                self.cache.invalidate()
+            self._seen = generation
+
+    async def bump(self) -> bool:
+        """Invalidate the cache here and, through Redis, in every worker. Returns whether Redis was reached."""
+        self.cache.invalidate()
+        try:
+            # Stored as a string, as `check()` reads it back
+            self._seen = str(await self.client.incr(self.key)).encode()
+        except RedisError as e:
+            logger.warning("Bumping the cache generation failed, other workers are not invalidated: %s", e)
+            return False
+        return True
+
+
+class LocalGeneration:
+    """Invalidation of a TTLCache in this process only, with the interface of SharedGeneration"""
+
+    def __init__(self, cache: TTLCache):
+        self.cache = cache
+
+    async def check(self):
+        pass
+
+    async def bump(self) -> bool:
+        self.cache.invalidate()
+        return True
+
+
+CACHE_REDIS_URL = os.environ.get('EVENTS_CACHE_REDIS_URL')
+
+# Facet values. Each worker keeps its own copy; with Redis, invalidating them
+# reaches every worker, so they can be kept longer.
+facet_cache = TTLCache(ttl=float(os.environ.get('FACET_CACHE_TTL', 3600 if CACHE_REDIS_URL else 300)))
+
+if CACHE_REDIS_URL:
+    facet_generation = SharedGeneration(CACHE_REDIS_URL, "geode:facets:generation", facet_cache)
+else:
+    facet_generation = LocalGeneration(facet_cache)
+
+
+# Encoded /events responses. Shared through Redis when EVENTS_CACHE_REDIS_URL is set,
+# otherwise held per process up to EVENTS_CACHE_MB megabytes (0 disables the cache).
+EVENTS_CACHE_TTL = float(os.environ.get('EVENTS_CACHE_TTL', 600))
+
+if CACHE_REDIS_URL:
+    events_cache = RedisCache(CACHE_REDIS_URL, EVENTS_CACHE_TTL, prefix="geode:events")
+else:
+    events_cache = LRUCache(int(float(os.environ.get('EVENTS_CACHE_MB', 256)) * 2 ** 20), EVENTS_CACHE_TTL)
@@ -0,0 +1,77 @@
+"""Database connection setup shared by the web app and the command line tools"""
+
+import os
+
+from sqlalchemy import URL, create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from replicas import Replica, ReplicaRouter
+
+
+DB_URL = URL.create(
+    "postgresql+psycopg",
+    username=os.environ['PGUSER'],
+    password=os.environ['PGPASS'],
+    host=os.environ['PGHOST'],
+    database=os.environ['PGDATABASE']
+)
+
+# Worker processes serving the app; uvicorn reads the same variable for --workers
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# Connections all workers together may open, e.g. the server's max_connections
+# less a reserve for other clients. When set, it is split evenly between the
+# workers instead of the DB_POOL_SIZE and DB_MAX_OVERFLOW defaults.
+CONNECTION_BUDGET = int(os.environ.get('DB_CONNECTION_BUDGET', 0))
+
+if CONNECTION_BUDGET:
+    DEFAULT_POOL_SIZE, DEFAULT_MAX_OVERFLOW = max(1, CONNECTION_BUDGET // WORKERS), 0
+else:
+    DEFAULT_POOL_SIZE, DEFAULT_MAX_OVERFLOW = 5, 10
+
+# Connection pool settings, per engine and per process
+POOL_OPTIONS = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW)),
+    'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+}
+
+# psycopg prepares a statement on the server once it has run this many times
+# on a connection. Event queries are built with bound parameters so repeated
+# filter combinations reuse the same prepared statement. 0 prepares on first
+# use; an empty value disables server-side prepared statements, e.g. behind
+# PgBouncer in transaction pooling mode.
+PREPARE_THRESHOLD = os.environ.get('PG_PREPARE_THRESHOLD', '2')
+
+CONNECT_ARGS = {
+    'prepare_threshold': int(PREPARE_THRESHOLD) if PREPARE_THRESHOLD else None,
+}
+
+# Synchronous engine, for the command line tools
+engine = create_engine(DB_URL, connect_args=CONNECT_ARGS, **POOL_OPTIONS)
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Asynchronous engine, for the web app
+async_engine = create_async_engine(DB_URL, connect_args=CONNECT_ARGS, **POOL_OPTIONS)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Read-only replicas of the primary, as comma-separated host or host:port. Each
+# has its own pool with the same options. Reads use the primary when empty.
+REPLICA_HOSTS = [h.strip() for h in os.environ.get('PGREPLICA_HOSTS', '').split(',') if h.strip()]
+
+def _replica(host: str) -> Replica:
+    name, _, port = host.partition(':')
+    url = DB_URL.set(host=name, port=int(port) if port else None)
+    return Replica(host, create_async_engine(url, connect_args=CONNECT_ARGS, **POOL_OPTIONS))
+
+read_router = ReplicaRouter(
+    async_engine,
+    [_replica(host) for host in REPLICA_HOSTS],
+    max_lag=float(os.environ.get('REPLICA_MAX_LAG', 30)),
+    check_interval=float(os.environ.get('REPLICA_CHECK_INTERVAL', 10)),
+)
@@ -1,120 +1,422 @@
-from typing import Any, Dict, List
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, FrozenSet, List, Tuple
 
 
-from sqlalchemy import cast, func, select
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy import Column, Float, Integer, and_, bindparam, cast, distinct, func, or_, select
+from sqlalchemy.dialects.postgresql import JSON, TEXT
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import text
 
+from cache import TTLCache, facet_cache
+from filters import BBOX_PARAMS, DEFAULT_EVENT_FIELDS, EVENT_FIELDS, LIST_FILTERS, SUMMARY_FIELDS, EventFilters, _table_fields, events_query, list_predicate
 from models import *
+from schema import ROLLUP_CELL_DEGREES
+
+
+# How long to trust a lookup of which optional database objects exist
+relation_cache = TTLCache(ttl=60)
+
+@relation_cache.cached
+def relation_exists(db: Session, name: str) -> bool:
+    """Check whether a table or view exists, e.g. an optional materialized view"""
+    return db.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+
+
+def _use_summary(db: Session, fields: Optional[List[str]]) -> bool:
+    """Whether event_summary exists and holds every requested field"""
+    if fields is None or not set(fields) <= SUMMARY_FIELDS.keys():
+        return False
+    return relation_exists(db, EventSummary.__tablename__)
+
+
+def _geojson_array(features, as_text: bool):
+    """
+    Aggregate the rows of `features` into a JSON array of GeoJSON Features.
+
+    With `as_text` the array is built by concatenating the Feature strings,
+    so Postgres does not parse them and psycopg returns the JSON text as is,
+    ready to be sent without decoding and re-encoding it in Python.
+    """
+    if as_text:
+        return func.concat("[", func.string_agg(func.ST_AsGeoJSON(features), ","), "]")
+    return func.json_agg(cast(func.ST_AsGeoJSON(features), JSON))
+
 
 def load_events(
-    db: Session, 
-    min_lng: Optional[float], min_lat: Optional[float], 
-    max_lng: Optional[float], max_lat: Optional[float],
-    phylum: Optional[str],
-    taxonomic_class: Optional[List[str]],
-    taxonomic_order: Optional[List[str]],
-    family: Optional[List[str]],
-    genus: Optional[List[str]], 
-    species: Optional[List[str]],
-    habitat: Optional[List[str]],
-    country: Optional[List[str]],
-    continent_ocean: Optional[List[str]],
-    environmental_medium: Optional[List[str]],
-    establishment_means: Optional[List[str]],
-    min_year: Optional[int],
-    max_year: Optional[int]):
-    """Load all events in a bounding box"""
-
-    features_query = select(EventMetadata, SampleMetadata).join(SampleMetadata)
-
-    # XXX: convert to use a spatial query
-    if min_lng and max_lng and min_lat and max_lat:
-        features_query = features_query\
-                          .where(EventMetadata.decimal_latitude.between(min_lat, max_lat))\
-                          .where(EventMetadata.decimal_longitude.between(min_lng, max_lng))
+    db: Session,
+    filters: EventFilters,
+    fields: Optional[List[str]] = None,
+    event_ids: Optional[List[str]] = None,
+    as_text: bool = False):
+    """
+    Load all events in a bounding box.
+
+    `fields` limits the properties of each feature; all columns by default.
+    `event_ids` limits the result to those events, e.g. one page from
+    load_event_page.
+    Reads from the event_summary materialized view when it has been created
+    and holds every requested field.
+    With `as_text` the features are returned as JSON text rather than decoded.
+    """
+
+    features_query = events_query(
+        filters.shape,
+        summary=_use_summary(db, fields),
+        fields=tuple(fields) if fields is not None else None,
+        by_event_ids=event_ids is not None
+    )
+
+    features_subquery = features_query.subquery("features")
 
-    if phylum:
-        features_query = features_query.where(SampleMetadata.phylum.in_(phylum))
-    
-    if taxonomic_class:
-        features_query = features_query.where(SampleMetadata.taxonomic_class.in_(taxonomic_class))
+    final_query = select(_geojson_array(features_subquery, as_text))
 
-    if taxonomic_order:
-        features = features_query.where(SampleMetadata.taxonomic_order.in_(taxonomic_order))
+    rs = db.execute(final_query, {**filters.params(), "event_ids": event_ids}).all()
+    return rs
 
-    if family:
-        features_query = features_query.where(SampleMetadata.family.in_(family))
-    
-    if genus:
-        features_query = features_query.where(SampleMetadata.genus.in_(genus))
 
-    if species:
-        features_query = features_query.where(SampleMetadata.specific_epithet.in_(species))
-    
-    if habitat:
-        features_query = features_query.where(EventMetadata.habitat.in_(habitat))
+def load_event_page(
+    db: Session,
+    filters: EventFilters,
+    limit: int,
+    after: Optional[str],
+    fields: Optional[List[str]] = None) -> List[str]:
+    """
+    List the ids of up to `limit` matching events, in event_id order.
 
-    if country:
-        features_query = features_query.where(EventMetadata.country.in_(country))
+    Keyset pagination: `after` is the last event_id of the previous page, so
+    each page costs an index range scan no matter how deep it is.
+    `fields` are those the page will be loaded with: the ids come from the
+    same source as load_events will read, event_summary or the base tables.
+    """
 
-    if continent_ocean: 
-        features_query = features_query.where(EventMetadata.continent_ocean.in_(continent_ocean))
+    summary = _use_summary(db, fields)
 
-    if environmental_medium:
-        features_query = features_query.where(EventMetadata.environmental_medium.in_(environmental_medium))
+    features_query = events_query(filters.shape, summary=summary)
 
-    if establishment_means:
-        features_query = features_query.where(SampleMetadata.establishment_means.in_(establishment_means))
+    event_id = EventSummary.event_id if summary else EventMetadata.event_id
+    page_query = features_query.with_only_columns(event_id)\
+                    .distinct()\
+                    .order_by(event_id)\
+                    .limit(limit)
 
-    if min_year:
-        features_query = features_query.where(EventMetadata.year_collected >= min_year)
+    if after is not None:
+        page_query = page_query.where(event_id > bindparam("after"))
 
-    if max_year:
-        features_query = features_query.where(EventMetadata.year_collected <= max_year)
+    return list(db.execute(page_query, {**filters.params(), "after": after}).scalars())
 
-    features_subquery = features_query.subquery("features")
 
-    final_query = select(
-        func.json_agg(
-            cast(func.ST_AsGeoJSON(features_subquery), JSON)
-        )
-    ) 
+# Facet dimensions, keyed by the /events filter parameter name
+FACET_COLUMNS = LIST_FILTERS
+
+def load_facet_counts(db: Session, filters: EventFilters) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Count events per value of every facet dimension, in one query.
+
+    The counts for a dimension apply every active filter except the one on
+    that dimension, so they show which values are still reachable. Uses
+    GROUPING SETS with a FILTER clause per dimension.
+    """
 
-    rs = db.execute(final_query).all()
+    active, crosses_antimeridian = filters.shape
+
+    # The bounding box and years apply to every dimension
+    features_query = events_query(
+        (frozenset(name for name in active if name not in FACET_COLUMNS), crosses_antimeridian)
+    )
+
+    predicates = {
+        name: list_predicate(name, column)
+        for name, column in FACET_COLUMNS.items() if name in active
+    }
+
+    counts = []
+    for name in FACET_COLUMNS:
+        event_count = func.count(distinct(EventMetadata.event_id))
+        others = [predicate for other, predicate in predicates.items() if other != name]
+        if others:
+            event_count = event_count.filter(and_(*others))
+        counts.append(event_count.label(f"{name}_count"))
+
+    names = list(FACET_COLUMNS)
+    columns = list(FACET_COLUMNS.values())
+
+    facet_query = features_query.with_only_columns(
+        *[column.label(name) for name, column in FACET_COLUMNS.items()],
+        func.grouping(*columns).label("grouping"),
+        *counts
+    ).group_by(func.grouping_sets(*columns))
+
+    all_bits = (1 << len(names)) - 1
+
+    facets = {name: [] for name in names}
+    for row in db.execute(facet_query, filters.params()).mappings():
+        # GROUPING() sets a bit for every column not grouped in this row, with
+        # the first column as the most significant bit. Each grouping set has a
+        # single column, so exactly one bit is clear.
+        grouped_bit = ~row["grouping"] & all_bits
+        name = names[len(names) - grouped_bit.bit_length()]
+        count = row[f"{name}_count"]
+        if count:
+            facets[name].append({'value': row[name], 'count': count})
+
+    for values in facets.values():
+        values.sort(key=lambda v: v['count'], reverse=True)
+
+    return facets
+
+
+# Width of a cluster cell in screen pixels, on 256 pixel map tiles
+CLUSTER_CELL_PIXELS = 64
+
+# Columns a cluster can break its count down by
+CLUSTER_BREAKDOWNS = {
+    'phylum': SampleMetadata.phylum,
+    'taxonomic_class': SampleMetadata.taxonomic_class,
+}
+
+def load_event_clusters(db: Session, filters: EventFilters, zoom: int, breakdown: str, as_text: bool = False):
+    """
+    Aggregate events into one feature per grid cell for the given map zoom level.
+
+    Points are snapped to a grid CLUSTER_CELL_PIXELS wide on screen. Each
+    cluster is placed at the centroid of its points and carries the total
+    count plus counts per value of the breakdown column.
+    With `as_text` the features are returned as JSON text rather than decoded.
+    """
+
+    features_query = events_query(filters.shape)
+
+    grid_size = 360.0 / 2 ** zoom * CLUSTER_CELL_PIXELS / 256
+
+    points = features_query.with_only_columns(
+        EventMetadata.geom,
+        func.ST_SnapToGrid(EventMetadata.geom, grid_size).label("cell"),
+        CLUSTER_BREAKDOWNS[breakdown].label("category")
+    ).subquery("points")
+
+    per_category = select(
+        points.c.cell,
+        points.c.category,
+        func.count().label("n"),
+        func.ST_Collect(points.c.geom).label("geom")
+    ).group_by(points.c.cell, points.c.category).subquery("per_category")
+
+    clusters = select(
+        func.ST_Centroid(func.ST_Collect(per_category.c.geom)).label("geom"),
+        func.sum(per_category.c.n).label("count"),
+        func.json_object_agg(
+            func.coalesce(per_category.c.category, "unknown"), per_category.c.n
+        ).label(breakdown)
+    ).group_by(per_category.c.cell).subquery("clusters")
+
+    final_query = select(_geojson_array(clusters, as_text))
+
+    rs = db.execute(final_query, filters.params()).all()
     return rs
 
 
-def load_event_all_stats(db: Session, event_id: str):
-    results = db.execute(
-        text(
-            """
-            SELECT *
+# Rows fetched per round trip from the server-side cursor when streaming
+STREAM_BATCH_SIZE = 1000
+
+async def stream_events(
+    db: AsyncSession,
+    filters: EventFilters,
+    fields: Optional[List[str]] = None,
+    event_ids: Optional[List[str]] = None) -> AsyncIterator[str]:
+    """
+    Yield each matching event as a GeoJSON Feature string.
+
+    Rows are read through a server-side cursor in batches of STREAM_BATCH_SIZE,
+    so memory use does not depend on the number of matching events.
+    """
+
+    summary = await db.run_sync(_use_summary, fields)
+
+    features_query = events_query(
+        filters.shape,
+        summary=summary,
+        fields=tuple(fields) if fields is not None else None,
+        by_event_ids=event_ids is not None
+    )
+
+    features_subquery = features_query.subquery("features")
+
+    final_query = select(func.ST_AsGeoJSON(features_subquery))\
+                    .execution_options(yield_per=STREAM_BATCH_SIZE)
+
+    result = await db.stream(final_query, {**filters.params(), "event_ids": event_ids})
+    async for feature in result.scalars():
+        yield feature
+
+
+# Spatial reference of web map tiles (web mercator)
+TILE_SRID = 3857
+
+# Properties carried by each point in a vector tile
+TILE_ATTRIBUTES = [
+    EventMetadata.event_id,
+    SampleMetadata.phylum,
+    SampleMetadata.taxonomic_class.label("taxonomic_class"),
+    SampleMetadata.taxonomic_order,
+    SampleMetadata.family,
+    SampleMetadata.genus,
+    SampleMetadata.specific_epithet,
+    EventMetadata.country,
+    EventMetadata.year_collected,
+]
+
+def load_event_tile(db: Session, filters: EventFilters, z: int, x: int, y: int) -> bytes:
+    """Encode the events inside tile z/x/y as a Mapbox Vector Tile"""
+
+    features_query = events_query(filters.shape)
+
+    tile_bounds = func.ST_TileEnvelope(z, x, y)
+
+    tile_query = features_query\
+                    .with_only_columns(
+                        func.ST_AsMVTGeom(
+                            func.ST_Transform(EventMetadata.geom, TILE_SRID), tile_bounds
+                        ).label("geom"),
+                        *TILE_ATTRIBUTES
+                    )\
+                    .where(EventMetadata.geom.op('&&')(func.ST_Transform(tile_bounds, SRID)))
+
+    tile_subquery = tile_query.subquery("events")
+
+    tile = db.execute(
+        select(func.ST_AsMVT(tile_subquery.table_valued(), "events")),
+        filters.params()
+    ).scalar()
+    return bytes(tile or b"")
+
+
+# Columns the stats endpoints can return, keyed by name
+ALL_STATS_FIELDS = _table_fields(
+    EventMetadata.__table__, SampleMetadata.__table__, Datasets.__table__, StacksRuns.__table__,
+    PopulationsSumStatsSummaryAllPositions.__table__
+)
+VARIANT_STATS_FIELDS = _table_fields(
+    EventMetadata.__table__, SampleMetadata.__table__, Datasets.__table__, StacksRuns.__table__,
+    PopulationsSumStatsSummaryVariantPositions.__table__
+)
+
+def _select_list(fields: Optional[List[str]], available: Dict[str, Column]) -> str:
+    """
+    SELECT list for the named fields, or all of `available`. Names must be keys of `available`.
+
+    Columns are always listed, so joins reaching the same tables by different
+    routes return the same columns.
+    """
+    if fields is None:
+        fields = list(available)
+    return ", ".join(
+        f'{available[f].table.name}."{available[f].name}" AS "{f}"' for f in fields
+    )
+
+# Join from an event to its populations summary stats, one row per sample and population
+ALL_STATS_FROM = """
             FROM event_metadata 
             JOIN sample_metadata USING (event_id)
             JOIN datasets USING (dataset_name)
             JOIN stacks_runs ON (stacks_runs.stacks_run_name = datasets.r80 AND stacks_runs.dataset_name = datasets.dataset_name)
             JOIN populations_sumstats_summary_all_positions USING (stacks_run_id)
-            WHERE event_metadata.event_id = :event_id
-            """
-        ),
-        { "event_id": event_id }
-    )
+"""
 
-    return results.fetchall()
-
-def load_event_variant_stats(db: Session, event_id: str):
-    results = db.execute(
-        text(
-            """
-            SELECT *
+VARIANT_STATS_FROM = """
             FROM event_metadata 
             JOIN sample_metadata USING (event_id)
             JOIN datasets USING (dataset_name)
-            JOIN stacks_runs ON stacks_runs.stacks_run_name = datasets.r80
+            JOIN stacks_runs ON (stacks_runs.stacks_run_name = datasets.r80 AND stacks_runs.dataset_name = datasets.dataset_name)
             JOIN populations_sumstats_summary_variant_positions USING (stacks_run_id)
-            WHERE event_metadata.event_id = :event_id
+"""
+
+# The full join again, with the stacks run of each sample found through the
+# event_stacks_runs materialized view instead of by comparing r80 names
+ALL_STATS_FULL_RUN_FROM = """
+            FROM event_metadata
+            JOIN sample_metadata USING (event_id)
+            JOIN datasets USING (dataset_name)
+            JOIN event_stacks_runs ON (event_stacks_runs.event_id = sample_metadata.event_id AND event_stacks_runs.dataset_name = sample_metadata.dataset_name)
+            JOIN stacks_runs ON (stacks_runs.stacks_run_id = event_stacks_runs.stacks_run_id)
+            JOIN populations_sumstats_summary_all_positions ON (populations_sumstats_summary_all_positions.stacks_run_id = stacks_runs.stacks_run_id)
+"""
+
+VARIANT_STATS_FULL_RUN_FROM = """
+            FROM event_metadata
+            JOIN sample_metadata USING (event_id)
+            JOIN datasets USING (dataset_name)
+            JOIN event_stacks_runs ON (event_stacks_runs.event_id = sample_metadata.event_id AND event_stacks_runs.dataset_name = sample_metadata.dataset_name)
+            JOIN stacks_runs ON (stacks_runs.stacks_run_id = event_stacks_runs.stacks_run_id)
+            JOIN populations_sumstats_summary_variant_positions ON (populations_sumstats_summary_variant_positions.stacks_run_id = stacks_runs.stacks_run_id)
+"""
+
+# Through event_stacks_runs without the event and dataset tables: an index probe
+# on event_id, then joins on stacks_run_id. Its samples are joined only so there
+# is still one row per sample and population, as from the full joins.
+ALL_STATS_RUN_FROM = """
+            FROM event_stacks_runs
+            JOIN sample_metadata ON (sample_metadata.event_id = event_stacks_runs.event_id AND sample_metadata.dataset_name = event_stacks_runs.dataset_name)
+            JOIN stacks_runs ON (stacks_runs.stacks_run_id = event_stacks_runs.stacks_run_id)
+            JOIN populations_sumstats_summary_all_positions ON (populations_sumstats_summary_all_positions.stacks_run_id = stacks_runs.stacks_run_id)
+"""
+
+VARIANT_STATS_RUN_FROM = """
+            FROM event_stacks_runs
+            JOIN sample_metadata ON (sample_metadata.event_id = event_stacks_runs.event_id AND sample_metadata.dataset_name = event_stacks_runs.dataset_name)
+            JOIN stacks_runs ON (stacks_runs.stacks_run_id = event_stacks_runs.stacks_run_id)
+            JOIN populations_sumstats_summary_variant_positions ON (populations_sumstats_summary_variant_positions.stacks_run_id = stacks_runs.stacks_run_id)
+"""
+
+# Columns available through event_stacks_runs, i.e. without the event and dataset tables
+ALL_STATS_RUN_FIELDS = _table_fields(
+    EventStacksRuns.__table__, StacksRuns.__table__, PopulationsSumStatsSummaryAllPositions.__table__
+)
+VARIANT_STATS_RUN_FIELDS = _table_fields(
+    EventStacksRuns.__table__, StacksRuns.__table__, PopulationsSumStatsSummaryVariantPositions.__table__
+)
+
+# (FROM clause, fields) of the stats queries, by positions: the full join by r80 name,
+# the full join through event_stacks_runs, then event_stacks_runs alone
+STATS_SOURCES = {
+    'all': (
+        (ALL_STATS_FROM, ALL_STATS_FIELDS),
+        (ALL_STATS_FULL_RUN_FROM, ALL_STATS_FIELDS),
+        (ALL_STATS_RUN_FROM, ALL_STATS_RUN_FIELDS),
+    ),
+    'variant': (
+        (VARIANT_STATS_FROM, VARIANT_STATS_FIELDS),
+        (VARIANT_STATS_FULL_RUN_FROM, VARIANT_STATS_FIELDS),
+        (VARIANT_STATS_RUN_FROM, VARIANT_STATS_RUN_FIELDS),
+    ),
+}
+
+def _stats_source(db: Session, positions: str, fields: Optional[List[str]]) -> Tuple[str, Dict[str, Column]]:
+    """
+    FROM clause and available fields for a stats query.
+
+    When the event_stacks_runs materialized view has been created, stacks
+    runs are found through it, and the event and dataset tables are skipped
+    when every requested field is available without them. Otherwise joins
+    from event_metadata to the stacks run by dataset and r80 name. Every
+    source returns one row per sample and population.
+    """
+    full, full_by_run, by_run = STATS_SOURCES[positions]
+    if not relation_exists(db, EventStacksRuns.__tablename__):
+        return full
+    if fields is not None and set(fields) <= by_run[1].keys():
+        return by_run
+    return full_by_run
+
+def _load_stats(db: Session, positions: str, event_id: str, fields: Optional[List[str]]):
+    from_clause, available = _stats_source(db, positions, fields)
+    event_table = available["event_id"].table.name
+    results = db.execute(
+        text(
+            f"""
+            SELECT {_select_list(fields, available)}
+            {from_clause}
+            WHERE {event_table}.event_id = :event_id
             """
         ),
         { "event_id": event_id }
@@ -122,7 +424,175 @@ def load_event_variant_stats(db: Session, event_id: str):
 
     return results.fetchall()
 
+def load_event_all_stats(db: Session, event_id: str, fields: Optional[List[str]] = None):
+    return _load_stats(db, 'all', event_id, fields)
+
+def load_event_variant_stats(db: Session, event_id: str, fields: Optional[List[str]] = None):
+    return _load_stats(db, 'variant', event_id, fields)
+
+
+def _load_stats_by_event(
+    db: Session,
+    positions: str,
+    event_ids: List[str],
+    fields: Optional[List[str]]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Run one stats query for many events and group the rows by event_id.
+
+    Rows hold only the requested fields; event_id is selected for the
+    grouping but left out unless it was asked for.
+    """
+    drop_event_id = fields is not None and "event_id" not in fields
+    if drop_event_id:
+        fields = ["event_id"] + fields
+
+    from_clause, available = _stats_source(db, positions, fields)
+    event_table = available["event_id"].table.name
+    results = db.execute(
+        text(
+            f"""
+            SELECT {_select_list(fields, available)}
+            {from_clause}
+            WHERE {event_table}.event_id = ANY(:event_ids)
+            """
+        ),
+        { "event_ids": event_ids }
+    )
 
+    stats = {}
+    for row in results:
+        values = row._asdict()
+        event_id = values.pop("event_id") if drop_event_id else values["event_id"]
+        stats.setdefault(event_id, []).append(values)
+    return stats
+
+def load_events_all_stats(db: Session, event_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """All-positions summary stats for many events in one query, keyed by event_id"""
+    return _load_stats_by_event(db, 'all', event_ids, fields)
+
+def load_events_variant_stats(db: Session, event_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Variant-positions summary stats for many events in one query, keyed by event_id"""
+    return _load_stats_by_event(db, 'variant', event_ids, fields)
+
+
+# Populations summary stats tables, by the `positions` they cover
+STATS_TABLES = {
+    'all': PopulationsSumStatsSummaryAllPositions,
+    'variant': PopulationsSumStatsSummaryVariantPositions,
+}
+
+# Numeric stats columns that can be aggregated, per positions
+AGGREGATE_STATS_FIELDS = {
+    positions: {
+        column.name: column
+        for column in table.__table__.columns
+        if column.name not in ('id', 'stacks_run_id', 'pop_id')
+    }
+    for positions, table in STATS_TABLES.items()
+}
+
+DEFAULT_AGGREGATE_STATS = ['pi', 'fis', 'obs_het', 'exp_het']
+
+# Columns the stats aggregates can be grouped by, keyed by /events filter parameter name
+AGGREGATE_GROUPS = {
+    name: LIST_FILTERS[name]
+    for name in ('phylum', 'taxonomic_class', 'taxonomic_order', 'family', 'genus', 'species', 'country', 'continent_ocean')
+}
+
+@lru_cache(maxsize=256)
+def _stats_aggregate_query(
+    shape: Tuple[FrozenSet[str], bool],
+    by_run: bool,
+    positions: str,
+    group_by: str,
+    stats: Tuple[str, ...]):
+    """Build the aggregate statement for load_stats_aggregates; cached like filters.events_query"""
+
+    features_query = events_query(shape)
+    if by_run:
+        features_query = features_query.join(EventStacksRuns, and_(
+            EventStacksRuns.event_id == SampleMetadata.event_id,
+            EventStacksRuns.dataset_name == SampleMetadata.dataset_name
+        ))
+        stacks_run_id = EventStacksRuns.stacks_run_id
+    else:
+        features_query = features_query\
+                            .join(Datasets, Datasets.dataset_name == SampleMetadata.dataset_name)\
+                            .join(StacksRuns, and_(
+                                StacksRuns.stacks_run_name == Datasets.r80,
+                                StacksRuns.dataset_name == Datasets.dataset_name
+                            ))
+        stacks_run_id = StacksRuns.stacks_run_id
+
+    # Each stacks run holds the stats of a whole dataset, so count its
+    # populations once per group however many matching events share it
+    runs = features_query\
+                .with_only_columns(AGGREGATE_GROUPS[group_by].label("value"), stacks_run_id.label("stacks_run_id"))\
+                .distinct()\
+                .subquery("runs")
+
+    table = STATS_TABLES[positions]
+    weight = cast(table.num_indiv, Float)
+
+    columns = []
+    for name in stats:
+        value = cast(AGGREGATE_STATS_FIELDS[positions][name], Float)
+        columns += [
+            func.count(value).label(f"{name}__count"),
+            func.avg(value).label(f"{name}__mean"),
+            (func.sum(value * weight) / func.nullif(func.sum(weight).filter(value.is_not(None)), 0))
+                .label(f"{name}__weighted_mean"),
+            func.min(value).label(f"{name}__min"),
+            func.max(value).label(f"{name}__max"),
+        ]
+
+    return select(
+                runs.c.value,
+                func.count(distinct(runs.c.stacks_run_id)).label("stacks_runs"),
+                func.count().label("populations"),
+                *columns
+            )\
+            .select_from(runs)\
+            .join(table, table.stacks_run_id == runs.c.stacks_run_id)\
+            .group_by(runs.c.value)\
+            .order_by(runs.c.value)
+
+def load_stats_aggregates(
+    db: Session,
+    filters: EventFilters,
+    positions: str,
+    group_by: str,
+    stats: List[str]) -> List[Dict[str, Any]]:
+    """
+    Aggregate the populations summary stats of the matching events, per value of `group_by`.
+
+    For each stat: the count of populations with a value, the mean, the mean
+    weighted by num_indiv, the min and the max. Computed in one statement,
+    joining the stats tables on stacks_run_id (indexed, see schema.py), from
+    the event_stacks_runs materialized view when it has been created.
+    """
+
+    by_run = relation_exists(db, EventStacksRuns.__tablename__)
+    query = _stats_aggregate_query(filters.shape, by_run, positions, group_by, tuple(stats))
+
+    groups = []
+    for row in db.execute(query, filters.params()).mappings():
+        groups.append({
+            group_by: row["value"],
+            'stacks_runs': row["stacks_runs"],
+            'populations': row["populations"],
+            'stats': {
+                name: {
+                    aggregate: row[f"{name}__{aggregate}"]
+                    for aggregate in ('count', 'mean', 'weighted_mean', 'min', 'max')
+                }
+                for name in stats
+            },
+        })
+    return groups
+
+
+@facet_cache.cached
 def unique_phylum(db: Session) -> List[Optional[str]]:
     """List distinct pyhla in the database"""
     phyla = db.query(SampleMetadata.phylum)\
@@ -130,6 +600,7 @@ def unique_phylum(db: Session) -> List[Optional[str]]:
             .all()
     return [p[0] for p in phyla]
 
+@facet_cache.cached
 def unique_class(db: Session) -> List[Optional[str]]:
     """List distinct classes in the database"""
     classes = db.query(SampleMetadata.taxonomic_class)\
@@ -137,6 +608,7 @@ def unique_class(db: Session) -> List[Optional[str]]:
                 .all()
     return [c[0] for c in classes]
 
+@facet_cache.cached
 def unique_order(db: Session) -> List[Optional[str]]:
     """List distinct orders in the database"""
     orders = db.query(SampleMetadata.taxonomic_order)\
@@ -144,6 +616,7 @@ def unique_order(db: Session) -> List[Optional[str]]:
                 .all()
     return [o[0] for o in orders]
 
+@facet_cache.cached
 def unique_family(db: Session) -> List[Optional[str]]:
     """List distinct families in the database"""
     families = db.query(SampleMetadata.family)\
@@ -151,6 +624,7 @@ def unique_family(db: Session) -> List[Optional[str]]:
                 .all()
     return [f[0] for f in families]
 
+@facet_cache.cached
 def unique_genus(db: Session) -> List[Optional[str]]:
     """List distinct genera in the database"""
     genera = db.query(SampleMetadata.genus)\
@@ -158,6 +632,7 @@ def unique_genus(db: Session) -> List[Optional[str]]:
                 .all()
     return [g[0] for g in genera]
 
+@facet_cache.cached
 def unique_species(db: Session) -> List[Optional[str]]:
     """List distinct species in the database"""
     species =  db.query(SampleMetadata.specific_epithet)\
@@ -165,6 +640,7 @@ def unique_species(db: Session) -> List[Optional[str]]:
                 .all()
     return [s[0] for s in species]
 
+@facet_cache.cached
 def unique_environmental_medium(db: Session) -> List[Optional[str]]:
     """List distinct environmental media in the database."""
     media = db.query(EventMetadata.environmental_medium)\
@@ -172,6 +648,7 @@ def unique_environmental_medium(db: Session) -> List[Optional[str]]:
                 .all()
     return [m[0] for m in media]
 
+@facet_cache.cached
 def unique_establishment_means(db: Session) -> List[Optional[str]]:
     """List distinct establishment means in the database."""
     means = db.query(SampleMetadata.establishment_means)\
@@ -179,6 +656,7 @@ def unique_establishment_means(db: Session) -> List[Optional[str]]:
                 .all()
     return [m[0] for m in means]
 
+@facet_cache.cached
 def unique_habitats(db: Session) -> List[Optional[str]]:
     """List distinct habitats in the database."""
     habitats = db.query(EventMetadata.habitat)\
@@ -186,6 +664,7 @@ def unique_habitats(db: Session) -> List[Optional[str]]:
                 .all()
     return [h[0] for h in habitats]
 
+@facet_cache.cached
 def year_range(db: Session) -> Dict[str, int]:
     """Return dictionary of min, max collection years in the database."""
     results = db.query(
@@ -194,3 +673,140 @@ def year_range(db: Session) -> Dict[str, int]:
     ).first()
 
     return { 'min_year': results[0], 'max_year': results[1] }
+
+
+# Fields /search looks in, as named in the search_terms materialized view
+SEARCH_FIELDS = (
+    'phylum', 'taxonomic_class', 'taxonomic_order', 'family', 'genus', 'species',
+    'colloquial_name', 'country', 'locality',
+)
+
+def _escape_like(value: str) -> str:
+    """Escape LIKE wildcards with backslash, Postgres's default LIKE escape character"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+@lru_cache(maxsize=2)
+def _search_query(by_field: bool):
+    """Build the search statement for search_terms; with `by_field`, only match the `fields` parameter"""
+    q = bindparam('q', type_=TEXT)
+    query = select(SearchTerms.field, SearchTerms.value, SearchTerms.events)\
+                .where(or_(
+                    SearchTerms.value.ilike(bindparam('pattern', type_=TEXT)),
+                    q.op('<%')(SearchTerms.value)
+                ))\
+                .order_by(
+                    func.starts_with(func.lower(SearchTerms.value), func.lower(q)).desc(),
+                    func.word_similarity(q, SearchTerms.value).desc(),
+                    SearchTerms.events.desc(),
+                    SearchTerms.value
+                )\
+                .limit(bindparam('limit', type_=Integer))
+    if by_field:
+        query = query.where(list_predicate('fields', SearchTerms.field))
+    return query
+
+def search_terms(db: Session, q: str, limit: int, fields: Optional[List[str]] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Find taxonomy and locality values matching `q`, for typeahead.
+
+    Matches values containing `q`, or with a word similar to it, through the
+    trigram index on the search_terms materialized view. Values starting with
+    `q` come first, then by word similarity, then by number of events.
+    Returns None when search_terms has not been created.
+    """
+    if not relation_exists(db, SearchTerms.__tablename__):
+        return None
+
+    rows = db.execute(
+        _search_query(fields is not None),
+        {"q": q, "pattern": f"%{_escape_like(q)}%", "limit": limit, "fields": fields}
+    ).mappings()
+    return [dict(row) for row in rows]
+
+
+# Filters the event_time_rollup table can apply, besides the years and bounding box
+ROLLUP_LIST_FILTERS = {
+    name: getattr(EventTimeRollup, name)
+    for name in ('country', 'continent_ocean', 'habitat', 'environmental_medium')
+}
+
+HISTOGRAM_INTERVALS = ('year', 'month')
+
+def _use_rollup(db: Session, filters: EventFilters) -> bool:
+    """
+    Whether event_time_rollup exists and can apply every active filter.
+
+    A bounding box must follow the rollup's cell edges, or the cells it cuts
+    through would be counted whole.
+    """
+    active, crosses_antimeridian = filters.shape
+    allowed = ROLLUP_LIST_FILTERS.keys() | {'min_year', 'max_year'}
+    if filters.bbox_on_grid(ROLLUP_CELL_DEGREES):
+        allowed |= set(BBOX_PARAMS)
+    return active <= allowed and relation_exists(db, EventTimeRollup.__tablename__)
+
+@lru_cache(maxsize=256)
+def _histogram_query(shape: Tuple[FrozenSet[str], bool], rollup: bool, summary: bool, interval: str):
+    """Build the histogram statement for load_event_histogram; cached like filters.events_query"""
+    active, crosses_antimeridian = shape
+
+    if not rollup:
+        E = EventSummary if summary else EventMetadata
+        bins = [E.year_collected] if interval == 'year' else [E.year_collected, E.month_collected]
+        return events_query(shape, summary=summary)\
+                    .with_only_columns(*bins, func.count(distinct(E.event_id)).label("events"))\
+                    .group_by(*bins)\
+                    .order_by(*bins)
+
+    R = EventTimeRollup
+    bins = [R.year_collected] if interval == 'year' else [R.year_collected, R.month_collected]
+    query = select(*bins, func.sum(R.events).label("events"))\
+                .group_by(*bins)\
+                .having(func.sum(R.events) > 0)\
+                .order_by(*bins)
+
+    # Cells are identified by their south-west corner, and the box follows cell edges
+    if 'min_lng' in active:
+        min_lng, max_lng = bindparam('min_lng', type_=Float), bindparam('max_lng', type_=Float)
+        if crosses_antimeridian:
+            query = query.where(or_(R.cell_lng >= min_lng, R.cell_lng < max_lng))
+        else:
+            query = query.where(R.cell_lng >= min_lng, R.cell_lng < max_lng)
+        query = query.where(R.cell_lat >= bindparam('min_lat', type_=Float), R.cell_lat < bindparam('max_lat', type_=Float))
+
+    for name, column in ROLLUP_LIST_FILTERS.items():
+        if name in active:
+            query = query.where(list_predicate(name, column))
+
+    if 'min_year' in active:
+        query = query.where(R.year_collected >= bindparam('min_year', type_=Integer))
+
+    if 'max_year' in active:
+        query = query.where(R.year_collected <= bindparam('max_year', type_=Integer))
+
+    return query
+
+def load_event_histogram(db: Session, filters: EventFilters, interval: str) -> List[Dict[str, Any]]:
+    """
+    Count events per year, or per year and month, under the same filters as /events.
+
+    Reads the event_time_rollup table when it has been created and the
+    filters are all on its columns: years, country, continent_ocean,
+    habitat, environmental_medium and a bounding box whose edges are on the
+    rollup's ROLLUP_CELL_DEGREES grid. Other filters, e.g. on taxa or a box
+    cutting through cells, count the matching events directly. Either way
+    only events with samples are counted. Months are null when unknown.
+    """
+    rollup = _use_rollup(db, filters)
+    summary = not rollup and relation_exists(db, EventSummary.__tablename__)
+
+    query = _histogram_query(filters.shape, rollup, summary, interval)
+
+    bins = []
+    for row in db.execute(query, filters.params()).mappings():
+        counts = {'year': row["year_collected"], 'events': int(row["events"])}
+        if interval == 'month':
+            # The rollup stores missing months as 0
+            counts['month'] = row["month_collected"] or None
+        bins.append(counts)
+    return bins
@@ -0,0 +1,296 @@
+"""
+Bulk exports of the events matching a set of filters, as CSV or NDJSON.
+
+The rows are produced by Postgres with COPY ... TO STDOUT and written to the
+output as they arrive, so an export of any size runs in constant memory.
+Each row is one sample with its event columns and, when `stats` is given,
+one row per population of its stacks run with that population's summary
+stats.
+
+Exports requested through the API are jobs: a JSON status file and the
+artifact in EXPORT_DIR, written by a `manage.py export --job` process the
+API starts, so the web workers only read files. Several workers, or API
+instances sharing EXPORT_DIR, see the same jobs.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, BinaryIO, Callable, Dict, List, Optional
+
+from sqlalchemy import Connection, Engine, Select, and_
+
+from db import AGGREGATE_STATS_FIELDS, STATS_TABLES, relation_exists
+from filters import EVENT_FIELDS, EventFilters, events_query
+from models import Datasets, EventStacksRuns, SampleMetadata, StacksRuns
+
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+
+FORMATS = (CSV, NDJSON)
+
+MEDIA_TYPES = {
+    CSV: 'text/csv',
+    NDJSON: 'application/x-ndjson',
+}
+
+# Where export jobs keep their status and output
+EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'geode-exports'))
+
+# Jobs and their output are deleted this many hours after they were requested
+EXPORT_MAX_AGE_HOURS = float(os.environ.get('EXPORT_MAX_AGE_HOURS', 24))
+
+# Export processes allowed to run at once; further requests are refused
+EXPORT_MAX_RUNNING = int(os.environ.get('EXPORT_MAX_RUNNING', 2))
+
+# Seconds between updates of a running job's progress
+PROGRESS_INTERVAL = 1.0
+
+# Seconds a queued job may wait for its process to start before it is marked failed
+START_TIMEOUT = 60
+
+# Path of the command line tools that run the jobs
+MANAGE_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manage.py')
+
+
+def export_query(filters: EventFilters, stats: Optional[str], by_run: bool) -> Select:
+    """
+    Build the export select: every event and sample column except geom, plus
+    pop_id and the `stats` summary stats columns when `stats` is given.
+
+    With `by_run`, stats are found through the event_stacks_runs view rather
+    than by joining datasets and stacks_runs on names.
+    """
+    query = events_query(filters.shape, fields=tuple(EVENT_FIELDS))\
+                .with_only_columns(*[column.label(name) for name, column in EVENT_FIELDS.items()])
+
+    if stats is None:
+        return query
+
+    table = STATS_TABLES[stats]
+    if by_run:
+        query = query.outerjoin(EventStacksRuns, and_(
+            EventStacksRuns.event_id == SampleMetadata.event_id,
+            EventStacksRuns.dataset_name == SampleMetadata.dataset_name
+        ))
+        stacks_run_id = EventStacksRuns.stacks_run_id
+    else:
+        query = query\
+                    .outerjoin(Datasets, Datasets.dataset_name == SampleMetadata.dataset_name)\
+                    .outerjoin(StacksRuns, and_(
+                        StacksRuns.stacks_run_name == Datasets.r80,
+                        StacksRuns.dataset_name == Datasets.dataset_name
+                    ))
+        stacks_run_id = StacksRuns.stacks_run_id
+
+    return query\
+                .outerjoin(table, table.stacks_run_id == stacks_run_id)\
+                .add_columns(
+                    table.pop_id,
+                    *[column.label(name) for name, column in AGGREGATE_STATS_FIELDS[stats].items()]
+                )
+
+
+def copy_statement(conn: Connection, filters: EventFilters, format: str, stats: Optional[str]):
+    """The COPY ... TO STDOUT statement for an export, and its parameters"""
+    by_run = stats is not None and relation_exists(conn, EventStacksRuns.__tablename__)
+    compiled = export_query(filters, stats, by_run).compile(dialect=conn.dialect)
+    query = str(compiled)
+
+    if format == CSV:
+        return f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", compiled.construct_params(filters.params())
+
+    # One JSON object per line. Quote and delimiter characters that never
+    # appear in JSON text stop COPY from quoting or escaping it.
+    query = f"SELECT row_to_json(export) FROM ({query}) AS export"
+    return (
+        f"COPY ({query}) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')",
+        compiled.construct_params(filters.params())
+    )
+
+
+def copy_export(
+    conn: Connection,
+    filters: EventFilters,
+    format: str,
+    stats: Optional[str],
+    out: BinaryIO,
+    progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Write the export to `out` as Postgres produces it. Returns the number of rows.
+
+    `progress` is called with the number of bytes written so far after each
+    chunk of output.
+    """
+    statement, params = copy_statement(conn, filters, format, stats)
+
+    written = 0
+    with conn.connection.dbapi_connection.cursor() as cursor:
+        with cursor.copy(statement, params) as copy:
+            for data in copy:
+                out.write(data)
+                written += len(data)
+                if progress is not None:
+                    progress(written)
+        return cursor.rowcount
+
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{job_id}.json")
+
+def artifact_path(job: Dict[str, Any]) -> str:
+    """Where the output of a finished job is"""
+    return os.path.join(EXPORT_DIR, f"{job['id']}.{job['format']}")
+
+def write_job(job: Dict[str, Any]):
+    """Save a job's status, replacing the file so readers never see it half written"""
+    path = _job_path(job['id'])
+    with open(path + '.tmp', 'w') as f:
+        json.dump(job, f)
+    os.replace(path + '.tmp', path)
+
+def read_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """The status of a job, or None for an unknown or malformed id"""
+    try:
+        job_id = uuid.UUID(job_id).hex
+    except ValueError:
+        return None
+    try:
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def create_job(filters: EventFilters, format: str, stats: Optional[str]) -> Dict[str, Any]:
+    """Record a new queued job"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'format': format,
+        'stats': stats,
+        'filters': filters.params(),
+        'created': time.time(),
+        'started': None,
+        'finished': None,
+        'bytes': 0,
+        'rows': None,
+        'error': None,
+        'host': None,
+        'pid': None,
+    }
+    write_job(job)
+    return job
+
+
+def _jobs() -> List[Dict[str, Any]]:
+    if not os.path.isdir(EXPORT_DIR):
+        return []
+    jobs = []
+    for name in os.listdir(EXPORT_DIR):
+        if name.endswith('.json'):
+            job = read_job(name[:-len('.json')])
+            if job is not None:
+                jobs.append(job)
+    return jobs
+
+def _process_gone(job: Dict[str, Any]) -> bool:
+    """Whether a job's process has exited, as far as can be told from this host"""
+    if job['host'] != socket.gethostname():
+        return False
+    try:
+        os.kill(job['pid'], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+def running_jobs() -> int:
+    """
+    Count the jobs that are queued or whose process is still running.
+
+    A job whose process has gone, e.g. killed with its container, or never
+    started is marked failed.
+    """
+    count = 0
+    for job in _jobs():
+        if job['status'] == 'running' and _process_gone(job):
+            job.update(status='failed', error='Export process exited', finished=time.time())
+            write_job(job)
+        elif job['status'] == 'queued' and job['created'] < time.time() - START_TIMEOUT:
+            job.update(status='failed', error='Export process did not start', finished=time.time())
+            write_job(job)
+        elif job['status'] in ('queued', 'running'):
+            count += 1
+    return count
+
+def remove_expired_jobs():
+    """Delete jobs, and their output, requested more than EXPORT_MAX_AGE_HOURS ago"""
+    cutoff = time.time() - EXPORT_MAX_AGE_HOURS * 3600
+    for job in _jobs():
+        if job['created'] < cutoff and job['status'] not in ('queued', 'running'):
+            for path in (artifact_path(job), artifact_path(job) + '.part', _job_path(job['id'])):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def run_job(engine: Engine, job_id: str):
+    """Run a queued job, recording its progress, then its outcome, in its status file"""
+    job = read_job(job_id)
+    if job is None:
+        raise ValueError(f"Unknown export job {job_id}")
+
+    job.update(status='running', started=time.time(), host=socket.gethostname(), pid=os.getpid())
+    write_job(job)
+
+    last_update = time.monotonic()
+
+    def progress(written: int):
+        nonlocal last_update
+        if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+            job['bytes'] = written
+            write_job(job)
+            last_update = time.monotonic()
+
+    filters = EventFilters.create(**job['filters'])
+    path = artifact_path(job)
+    try:
+        with engine.connect() as conn, open(path + '.part', 'wb') as out:
+            rows = copy_export(conn, filters, job['format'], job['stats'], out, progress)
+        os.replace(path + '.part', path)
+        job.update(status='done', rows=rows, bytes=os.path.getsize(path))
+    except Exception as e:
+        job.update(status='failed', error=str(e).splitlines()[0] if str(e) else type(e).__name__)
+        raise
+    finally:
+        job['finished'] = time.time()
+        write_job(job)
+
+
+# Export processes started by this worker, kept until they exit
+_processes = set()
+
+async def start_job(job: Dict[str, Any]):
+    """Run a job in its own `manage.py export --job` process, without waiting for it"""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, MANAGE_PY, 'export', '--job', job['id'],
+        stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL,
+    )
+    task = asyncio.create_task(process.wait())
+    _processes.add(task)
+    task.add_done_callback(_processes.discard)
+
+
+def job_status(job: Dict[str, Any]) -> Dict[str, Any]:
+    """The public part of a job's status"""
+    return {key: value for key, value in job.items() if key not in ('host', 'pid')}
@@ -0,0 +1,267 @@
+"""
+Event filters and the query builder shared by the events helpers in db.py.
+
+Filters are normalised into an EventFilters value. Statements are built from
+its shape, i.e. which filters are set, with bound parameters for the values:
+lists are passed as arrays to `= ANY(...)` rather than as variable-length IN
+lists. Every request with the same shape therefore runs the same SQL text, so
+SQLAlchemy compiles it once and psycopg can prepare it on the server.
+"""
+
+import math
+from dataclasses import dataclass, fields as dataclass_fields, replace
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+from sqlalchemy import Column, Float, Integer, Select, Table, any_, bindparam, func, or_, select
+from sqlalchemy.dialects.postgresql import ARRAY, TEXT
+
+from models import SRID, EventMetadata, EventSummary, SampleMetadata
+
+
+# Filters matching a column against a list of values, keyed by /events parameter name
+LIST_FILTERS = {
+    'phylum': SampleMetadata.phylum,
+    'taxonomic_class': SampleMetadata.taxonomic_class,
+    'taxonomic_order': SampleMetadata.taxonomic_order,
+    'family': SampleMetadata.family,
+    'genus': SampleMetadata.genus,
+    'species': SampleMetadata.specific_epithet,
+    'habitat': EventMetadata.habitat,
+    'country': EventMetadata.country,
+    'continent_ocean': EventMetadata.continent_ocean,
+    'environmental_medium': EventMetadata.environmental_medium,
+    'establishment_means': SampleMetadata.establishment_means,
+}
+
+BBOX_PARAMS = ('min_lng', 'min_lat', 'max_lng', 'max_lat')
+
+
+# Columns the queries join tables on, so they hold the same value in every table of a row
+JOIN_COLUMNS = {"event_id", "dataset_name", "stacks_run_id"}
+
+def _table_fields(*tables: Table) -> Dict[str, Column]:
+    """
+    Map field names to columns across tables.
+
+    A join column is listed once, from the first table with it. Other names
+    repeated in a later table are qualified with its name, e.g.
+    sample_metadata.principal_investigator, so neither column is lost.
+    """
+    fields = {}
+    for table in tables:
+        for column in table.columns:
+            if column.name not in fields:
+                fields[column.name] = column
+            elif column.name not in JOIN_COLUMNS:
+                fields[f"{table.name}.{column.name}"] = column
+    return fields
+
+# Properties /events can return. geom is always returned as the feature geometry.
+EVENT_FIELDS = {
+    name: column
+    for name, column in _table_fields(EventMetadata.__table__, SampleMetadata.__table__).items()
+    if name != "geom"
+}
+
+# Properties available from the event_summary materialized view
+SUMMARY_FIELDS = {
+    name: column
+    for name, column in _table_fields(EventSummary.__table__).items()
+    if name != "geom"
+}
+
+# Compact set of properties returned by /events by default, for map display
+DEFAULT_EVENT_FIELDS = [
+    "event_id",
+    "phylum",
+    "class",
+    "taxonomic_order",
+    "family",
+    "genus",
+    "specific_epithet",
+    "colloquial_name",
+    "country",
+    "year_collected",
+]
+
+
+@dataclass(frozen=True)
+class EventFilters:
+    """The /events filters in canonical form. Build with EventFilters.create()."""
+
+    min_lng: Optional[float] = None
+    min_lat: Optional[float] = None
+    max_lng: Optional[float] = None
+    max_lat: Optional[float] = None
+    phylum: Tuple[str, ...] = ()
+    taxonomic_class: Tuple[str, ...] = ()
+    taxonomic_order: Tuple[str, ...] = ()
+    family: Tuple[str, ...] = ()
+    genus: Tuple[str, ...] = ()
+    species: Tuple[str, ...] = ()
+    habitat: Tuple[str, ...] = ()
+    country: Tuple[str, ...] = ()
+    continent_ocean: Tuple[str, ...] = ()
+    environmental_medium: Tuple[str, ...] = ()
+    establishment_means: Tuple[str, ...] = ()
+    min_year: Optional[int] = None
+    max_year: Optional[int] = None
+
+    @classmethod
+    def create(cls, **params: Any) -> "EventFilters":
+        """
+        Normalise raw filter values.
+
+        List filters become sorted tuples of distinct, non-blank values, so
+        the same selection in any order gives an equal EventFilters.
+        """
+        values = {}
+        for name, value in params.items():
+            if name in LIST_FILTERS:
+                value = tuple(sorted({v.strip() for v in value or () if v and v.strip()}))
+            values[name] = value
+        return cls(**values)
+
+    @property
+    def has_bbox(self) -> bool:
+        return None not in (self.min_lng, self.min_lat, self.max_lng, self.max_lat)
+
+    def snap_bbox(self, grid: float) -> "EventFilters":
+        """
+        Widen the bounding box outward to multiples of `grid` degrees.
+
+        The widened box matches more events, so only use it to compare boxes
+        with a grid, never to query.
+        """
+        if not self.has_bbox or grid <= 0:
+            return self
+
+        def snap(value, rounding, low, high):
+            return max(low, min(high, round(rounding(value / grid) * grid, 10)))
+
+        return replace(
+            self,
+            min_lng=snap(self.min_lng, math.floor, -180.0, 180.0),
+            min_lat=snap(self.min_lat, math.floor, -90.0, 90.0),
+            max_lng=snap(self.max_lng, math.ceil, -180.0, 180.0),
+            max_lat=snap(self.max_lat, math.ceil, -90.0, 90.0),
+        )
+
+    def bbox_on_grid(self, grid: float) -> bool:
+        """Whether every edge of the bounding box is a multiple of `grid` degrees"""
+        return self.has_bbox and self.snap_bbox(grid) == self
+
+    def active(self) -> Dict[str, Any]:
+        """The filters that are set. A bounding box counts only when all four edges are given."""
+        active = {}
+        for field in dataclass_fields(self):
+            value = getattr(self, field.name)
+            if value is None or value == ():
+                continue
+            if field.name in BBOX_PARAMS and not self.has_bbox:
+                continue
+            active[field.name] = value
+        return active
+
+    @property
+    def shape(self) -> Tuple[FrozenSet[str], bool]:
+        """Which filters are set, and whether the bounding box crosses the antimeridian."""
+        crosses_antimeridian = self.has_bbox and self.min_lng > self.max_lng
+        return frozenset(self.active()), crosses_antimeridian
+
+    def params(self) -> Dict[str, Any]:
+        """Bind parameter values for statements built from this filter's shape."""
+        return {
+            name: list(value) if isinstance(value, tuple) else value
+            for name, value in self.active().items()
+        }
+
+
+def list_predicate(name: str, column):
+    """Match `column` against the array bound to parameter `name`"""
+    return column == any_(bindparam(name, type_=ARRAY(TEXT)))
+
+
+def _envelope(min_lng, max_lng):
+    return func.ST_MakeEnvelope(
+        min_lng, bindparam('min_lat', type_=Float), max_lng, bindparam('max_lat', type_=Float), SRID
+    )
+
+def bbox_predicate(geom, crosses_antimeridian: bool):
+    """
+    Match rows whose geom falls in the bound bounding box.
+
+    Uses the && operator so a GiST index on the geom column can be used.
+    A box with min_lng > max_lng crosses the antimeridian and is split into
+    two envelopes, one on each side of it.
+    """
+    min_lng = bindparam('min_lng', type_=Float)
+    max_lng = bindparam('max_lng', type_=Float)
+
+    if not crosses_antimeridian:
+        return geom.op('&&')(_envelope(min_lng, max_lng))
+
+    return or_(
+        geom.op('&&')(_envelope(min_lng, 180.0)),
+        geom.op('&&')(_envelope(-180.0, max_lng))
+    )
+
+
+@lru_cache(maxsize=512)
+def events_query(
+    shape: Tuple[FrozenSet[str], bool],
+    summary: bool = False,
+    fields: Optional[Tuple[str, ...]] = None,
+    by_event_ids: bool = False) -> Select:
+    """
+    Build the filtered event/sample select for a filter shape.
+
+    With `summary`, read from the event_summary materialized view instead of
+    joining event_metadata and sample_metadata. With `fields`, select geom and
+    only those columns rather than every column. With `by_event_ids`, only
+    match the events in the `event_ids` parameter, ordered by event_id.
+
+    Execute the result with EventFilters.params() plus any parameters the
+    caller adds. Statements are cached per argument combination.
+    """
+    active, crosses_antimeridian = shape
+
+    if summary:
+        E = EventSummary
+        if fields is None:
+            features_query = select(EventSummary)
+        else:
+            features_query = select(E.geom, *[SUMMARY_FIELDS[f] for f in fields])
+    else:
+        E = EventMetadata
+        # Labelled with their field names, which tell apart columns of the same name
+        columns = EVENT_FIELDS.items() if fields is None else [(f, EVENT_FIELDS[f]) for f in fields]
+        features_query = select(E.geom, *[column.label(name) for name, column in columns])\
+                            .select_from(EventMetadata)\
+                            .join(SampleMetadata)
+
+    if by_event_ids:
+        features_query = features_query\
+                            .where(list_predicate('event_ids', E.event_id))\
+                            .order_by(E.event_id)
+
+    if 'min_lng' in active:
+        features_query = features_query.where(bbox_predicate(E.geom, crosses_antimeridian))
+
+    for name, column in LIST_FILTERS.items():
+        if name in active:
+            features_query = features_query.where(list_predicate(name, source_column(column, summary)))
+
+    if 'min_year' in active:
+        features_query = features_query.where(E.year_collected >= bindparam('min_year', type_=Integer))
+
+    if 'max_year' in active:
+        features_query = features_query.where(E.year_collected <= bindparam('max_year', type_=Integer))
+
+    return features_query
+
+
+def source_column(column, summary: bool):
+    """The event_summary column matching an event_metadata or sample_metadata column, when reading the view"""
+    return getattr(EventSummary, column.key) if summary else column
@@ -0,0 +1,147 @@
+"""
+Encodings of an /events page other than GeoJSON.
+
+Features come in as the GeoJSON dicts built by db.load_events. Event
+geometries are points, which the columnar formats carry as longitude and
+latitude columns, or as WKB for Arrow and GeoParquet.
+
+Arrow and GeoParquet need the optional pyarrow package.
+"""
+
+import io
+import json
+import struct
+from typing import Any, Dict, List, Optional
+
+from responses import dumps
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+GEOJSON = 'geojson'
+COLUMNAR = 'columnar'
+ARROW = 'arrow'
+PARQUET = 'parquet'
+
+MEDIA_TYPES = {
+    GEOJSON: 'application/geo+json',
+    COLUMNAR: 'application/json',
+    ARROW: 'application/vnd.apache.arrow.stream',
+    PARQUET: 'application/vnd.apache.parquet',
+}
+
+# Formats that need pyarrow
+ARROW_FORMATS = {ARROW, PARQUET}
+
+# Accept header media types, mapped to the format they select
+ACCEPT_FORMATS = {
+    'application/geo+json': GEOJSON,
+    'application/json': GEOJSON,
+    'application/vnd.geode.columnar+json': COLUMNAR,
+    'application/vnd.apache.arrow.stream': ARROW,
+    'application/vnd.apache.parquet': PARQUET,
+    'application/x-parquet': PARQUET,
+}
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    Pick a format from an Accept header, honouring q-values.
+
+    Falls back to GeoJSON when nothing in the header is recognised.
+    """
+    choices = []
+    for position, item in enumerate((accept or '').split(',')):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in ACCEPT_FORMATS and quality > 0:
+            choices.append((-quality, position, ACCEPT_FORMATS[media_type.lower()]))
+    return min(choices)[2] if choices else GEOJSON
+
+
+def available(format: str) -> bool:
+    """Whether the libraries needed to write `format` are installed"""
+    return format not in ARROW_FORMATS or pa is not None
+
+
+def _columns(features: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Pivot feature properties into one list per property, with point coordinates first"""
+    names = {}
+    for feature in features:
+        names.update(dict.fromkeys(feature['properties']))
+
+    columns = {'longitude': [], 'latitude': [], **{name: [] for name in names}}
+    for feature in features:
+        coordinates = (feature.get('geometry') or {}).get('coordinates') or (None, None)
+        columns['longitude'].append(coordinates[0])
+        columns['latitude'].append(coordinates[1])
+        for name in names:
+            columns[name].append(feature['properties'].get(name))
+    return columns
+
+
+def to_columnar(features: List[Dict[str, Any]], next_cursor: Optional[str]) -> bytes:
+    """Encode features as {"columns": {name: [values]}, "next": cursor}, naming each property once"""
+    body = {
+        'length': len(features),
+        'columns': _columns(features),
+        'next': next_cursor,
+    }
+    return dumps(body)
+
+
+def _wkb_point(lng: Optional[float], lat: Optional[float]) -> Optional[bytes]:
+    if lng is None or lat is None:
+        return None
+    # Little endian byte order, geometry type 1 (Point), then x and y
+    return struct.pack('<BIdd', 1, 1, lng, lat)
+
+
+def _table(features: List[Dict[str, Any]]) -> "pa.Table":
+    columns = _columns(features)
+    geometry = [_wkb_point(lng, lat) for lng, lat in zip(columns.pop('longitude'), columns.pop('latitude'))]
+
+    geometry_field = pa.field('geometry', pa.binary(), metadata={'ARROW:extension:name': 'geoarrow.wkb'})
+    arrays = [pa.array(geometry, type=pa.binary())]
+    fields = [geometry_field]
+    for name, values in columns.items():
+        array = pa.array([v if v is None or isinstance(v, (int, float, bool)) else str(v) for v in values])
+        arrays.append(array)
+        fields.append(pa.field(name, array.type))
+
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def to_arrow(features: List[Dict[str, Any]]) -> bytes:
+    """Encode features as an Arrow IPC stream with WKB geometry"""
+    table = _table(features)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def to_geoparquet(features: List[Dict[str, Any]]) -> bytes:
+    """Encode features as GeoParquet 1.0 with WKB geometry"""
+    table = _table(features)
+    geo = {
+        'version': '1.0.0',
+        'primary_column': 'geometry',
+        'columns': {
+            'geometry': {'encoding': 'WKB', 'geometry_types': ['Point']},
+        },
+    }
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'geo': json.dumps(geo).encode()})
+    sink = io.BytesIO()
+    pq.write_table(table, sink, compression='zstd')
+    return sink.getvalue()
@@ -1,19 +1,61 @@
 #!/usr/bin/env python3
 
+import asyncio
+import hmac
+import json
+import logging
 import os
-from typing import Any, Dict, List
+from contextlib import asynccontextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Literal
 
-from db import unique_phylum, unique_class, unique_order, unique_family, unique_genus, unique_species, unique_habitats, unique_environmental_medium, unique_establishment_means, year_range, load_events, load_event_all_stats, load_event_variant_stats
-from fastapi import Depends, FastAPI, HTTPException
-from fastapi.encoders import jsonable_encoder
+from db import unique_phylum, unique_class, unique_order, unique_family, unique_genus, unique_species, unique_habitats, unique_environmental_medium, unique_establishment_means, year_range, ALL_STATS_FIELDS, CLUSTER_BREAKDOWNS, DEFAULT_EVENT_FIELDS, EVENT_FIELDS, VARIANT_STATS_FIELDS, load_events, load_event_page, load_event_clusters, load_facet_counts, stream_events, load_event_tile, load_event_all_stats, load_event_variant_stats, load_events_all_stats, load_events_variant_stats, AGGREGATE_GROUPS, AGGREGATE_STATS_FIELDS, DEFAULT_AGGREGATE_STATS, load_stats_aggregates, SEARCH_FIELDS, search_terms, load_event_histogram
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from psycopg import OperationalError
-from sqlalchemy import URL, create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import text
 
+from cache import cache_key, events_cache, facet_generation
+from database import POOL_OPTIONS, async_engine, read_router, AsyncSessionLocal
+from filters import EventFilters
+import exports
+import formats
+import metrics
+from responses import FastJSONResponse
 
-app = FastAPI()
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+
+logger = logging.getLogger(__name__)
+
+# Warm the connection pool and caches at startup before reporting ready
+WARM_UP = os.environ.get('WARM_UP', 'true').lower() in ('1', 'true', 'yes')
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = not WARM_UP
+    tasks = []
+    if WARM_UP:
+        tasks.append(asyncio.create_task(warm_up(app)))
+    if read_router.replicas:
+        tasks.append(asyncio.create_task(read_router.monitor()))
+    yield
+    for task in tasks:
+        task.cancel()
+    for db_engine in read_router.engines():
+        await db_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,40 +63,114 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Cache"],
 )
 
-DB_URL = URL.create(
-    "postgresql+psycopg",
-    username=os.environ['PGUSER'],
-    password=os.environ['PGPASS'],
-    host=os.environ['PGHOST'],
-    database=os.environ['PGDATABASE']
-)
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
 
-engine = create_engine(DB_URL)
+# Brotli when brotli-asgi is installed and the client accepts it, otherwise gzip
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESS_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Outermost, so it times the whole request and counts compressed bytes
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(async_engine.sync_engine, 'primary')
+for replica in read_router.replicas:
+    metrics.instrument_engine(replica.engine.sync_engine, replica.name)
+metrics.instrument_sessions(AsyncSession.sync_session_class)
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_read_db():
+    """A session on a replica, or on the primary when no replica is configured or healthy"""
+    async with AsyncSessionLocal(bind=read_router.choose()) as db:
         yield db
+
+
+async def warm_up(app: FastAPI):
+    """
+    Fill this worker's connection pool, facet cache and default /events page.
+
+    Runs in the background at startup; /health reports 503 until it is done,
+    so a load balancer only sends traffic to warm workers. Failures are
+    logged and do not stop the worker from serving.
+    """
+    try:
+        connections = await asyncio.gather(*[
+            db_engine.connect() for db_engine in read_router.engines() for _ in range(POOL_OPTIONS['pool_size'])
+        ], return_exceptions=True)
+        try:
+            for connection in connections:
+                if isinstance(connection, BaseException):
+                    raise connection
+        finally:
+            # Return the connections that did open, or their pool slots stay taken
+            for connection in connections:
+                if not isinstance(connection, BaseException):
+                    await connection.close()
+
+        async with AsyncSessionLocal(bind=read_router.choose()) as db:
+            for helper in FACET_HELPERS:
+                await db.run_sync(helper.entry)
+            # The default map view, through the endpoint so its response is cached
+            await events(
+                fields=None, limit=EVENTS_MAX_PAGE_SIZE, after=None, stream=False, zoom=None,
+                cluster_by='phylum', format=formats.GEOJSON, accept=None,
+                filters=EventFilters.create(), db=db
+            )
+    except Exception:
+        logger.exception("Warm-up failed")
     finally:
-        db.close()
+        app.state.ready = True
 
 @app.get("/health")
-def health():
+async def health():
+    """
+    Ping the primary with a pooled connection, and report each replica's state.
+
+    Answers 503 while the worker is warming up and 500 if the primary is
+    unreachable. Unhealthy replicas do not fail the check, as reads fall back
+    to the primary.
+    """
+    if not getattr(app.state, 'ready', True):
+        raise HTTPException(status_code=503, detail="Warming up")
     try:
-        if engine.raw_connection().is_valid:
-            return {'status': 'OK'}
-        else:
-            HTTPException(status_code=500, detail="Error connecting to database")
-    except OperationalError:
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    except DBAPIError:
         raise HTTPException(status_code=500, detail="Error connecting to database")
 
+    response = {'status': 'OK'}
+    if read_router.replicas:
+        response['replicas'] = read_router.status()
+    return response
 
-@app.get("/events")
-def events(
+
+@app.get("/metrics")
+def get_metrics():
+    """Request, query and connection pool metrics in the Prometheus text format"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# Deepest zoom level the tile endpoint will render
+MAX_TILE_ZOOM = 22
+
+
+# Largest page of events /events returns, and the page size when no limit is given
+EVENTS_MAX_PAGE_SIZE = int(os.environ.get('EVENTS_MAX_PAGE_SIZE', 10000))
+
+async def _feature_collection(features: AsyncIterator[str], next_cursor: str | None) -> AsyncIterator[str]:
+    """Wrap GeoJSON Feature strings in a FeatureCollection, chunk by chunk."""
+    yield '{"type": "FeatureCollection", "features": ['
+    first = True
+    async for feature in features:
+        yield feature if first else ',' + feature
+        first = False
+    yield '], "next": ' + json.dumps(next_cursor) + '}'
+
+
+def event_filters(
     min_lng: float | None = None, 
     min_lat: float | None = None,
     max_lat: float | None = None, 
@@ -71,15 +187,15 @@ def events(
     environmental_medium: str | None = None,
     establishment_means: str | None = None,
     min_year: int | None = None,
-    max_year: int | None = None,
-    db: Session = Depends(get_db)) -> JSONResponse:
+    max_year: int | None = None) -> EventFilters:
     """
-    Query the events_metdata table to load events.
-    
+    Query parameters shared by the endpoints that filter events.
+
     Many of the string parameters can be comma-delimited.
     The function splits them to handle multiple inputs.
+    Returns the EventFilters taken by the event helpers in db.py.
     """
-    
+
     if phylum:
         phylum = phylum.split(',')
     if taxonomic_class:
@@ -92,6 +208,8 @@ def events(
         genus = genus.split(',')
     if species:
         species = species.split(',')
+    if habitat:
+        habitat = habitat.split(',')
     if country:
         country = country.split(',')
     if continent_ocean:
@@ -101,84 +219,486 @@ def events(
     if establishment_means:
         establishment_means = establishment_means.split(',')
 
-    features = load_events(
-        db, 
-        min_lng, min_lat, max_lng, max_lat, 
-        phylum, taxonomic_class, taxonomic_order, family, genus, species, 
-        habitat, country, continent_ocean,
-        environmental_medium,
-        establishment_means,
-        min_year, max_year
+    return EventFilters.create(
+        min_lng=min_lng, min_lat=min_lat, max_lng=max_lng, max_lat=max_lat,
+        phylum=phylum,
+        taxonomic_class=taxonomic_class,
+        taxonomic_order=taxonomic_order,
+        family=family,
+        genus=genus,
+        species=species,
+        habitat=habitat,
+        country=country,
+        continent_ocean=continent_ocean,
+        environmental_medium=environmental_medium,
+        establishment_means=establishment_means,
+        min_year=min_year,
+        max_year=max_year,
     )
-    features = features[0][0]
-    response = {
-        'type': 'FeatureCollection',
-        'features': features
-    }
 
-    return JSONResponse(content=jsonable_encoder(response))
+
+def _parse_fields(
+    fields: str | None,
+    available: Dict[str, Any],
+    default: List[str] | None = None) -> List[str] | None:
+    """
+    Split a comma-delimited `fields` parameter and check every name is available.
+
+    Returns `default` when no fields are given, and None (every column) for `fields=all`.
+    """
+    if not fields:
+        return default
+    if fields == 'all':
+        return None
+
+    fields = fields.split(',')
+    unknown = [f for f in fields if f not in available]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+@app.get("/events")
+async def events(
+    fields: str | None = None,
+    limit: int = Query(EVENTS_MAX_PAGE_SIZE, ge=1, le=EVENTS_MAX_PAGE_SIZE),
+    after: str | None = None,
+    stream: bool = False,
+    zoom: int | None = Query(None, ge=0, le=MAX_TILE_ZOOM),
+    cluster_by: str = 'phylum',
+    format: str | None = None,
+    accept: str | None = Header(None),
+    filters: EventFilters = Depends(event_filters),
+    db: AsyncSession = Depends(get_read_db)) -> Response:
+    """
+    Query the events_metdata table to load events.
+
+    With `stream=true` the FeatureCollection is written one Feature at a time
+    as rows arrive from the database, instead of being built in memory.
+
+    `fields` is a comma-delimited list of properties to return for each event.
+    It defaults to a compact set for map display; `fields=all` returns every column.
+
+    Results are paged by event_id. A page holds up to `limit` events (one
+    feature per sample), and `next` in the FeatureCollection is the cursor
+    to pass as `after` to fetch the following page, or null on the last page.
+
+    When `zoom` is set, events are clustered on the server for a map at that
+    zoom level. Each feature is a cluster with a `count` and a breakdown of
+    counts by the `cluster_by` column (phylum or taxonomic_class).
+
+    Responses other than streams are cached (see cache.events_cache), keyed
+    on the exact bounding box.
+
+    The page is GeoJSON unless `format` or the Accept header asks for
+    `columnar` JSON (one list per property), an `arrow` IPC stream or
+    `parquet` (GeoParquet). For the binary formats the `next` cursor is sent
+    in the X-Next-Cursor header.
+    """
+    fields = _parse_fields(fields, EVENT_FIELDS, DEFAULT_EVENT_FIELDS)
+
+    if format is None:
+        format = formats.negotiate(accept)
+    if format not in formats.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(formats.MEDIA_TYPES)}")
+    if format != formats.GEOJSON and (stream or zoom is not None):
+        raise HTTPException(status_code=400, detail="stream and zoom only return GeoJSON")
+    if not formats.available(format):
+        raise HTTPException(status_code=406, detail=f"The {format} format is not available on this server")
+    if zoom is not None and cluster_by not in CLUSTER_BREAKDOWNS:
+        raise HTTPException(status_code=400, detail=f"cluster_by must be one of {', '.join(CLUSTER_BREAKDOWNS)}")
+
+    # Clusters are never streamed, so `stream` only skips the cache without `zoom`
+    key = None
+    if zoom is not None or not stream:
+        key = cache_key(
+            'events', filters, tuple(fields) if fields is not None else None, limit, after, zoom, cluster_by, format
+        )
+        cached = await events_cache.get(key)
+        if cached is not None:
+            return _unpack_response(cached, {'X-Cache': 'hit'})
+
+    if zoom is not None:
+        features = await db.run_sync(load_event_clusters, filters, zoom, cluster_by, True)
+        body = ('{"type": "FeatureCollection", "features": ' + features[0][0] + '}').encode()
+        headers = {}
+    else:
+        event_ids = await db.run_sync(load_event_page, filters, limit, after, fields)
+        next_cursor = event_ids[-1] if len(event_ids) == limit else None
+
+        if stream:
+            features = stream_events(db, filters, fields=fields, event_ids=event_ids)
+            return StreamingResponse(_feature_collection(features, next_cursor), media_type="application/json")
+
+        headers = {}
+        if format == formats.GEOJSON:
+            # Pass the features through as the JSON text Postgres built
+            features = await db.run_sync(load_events, filters, fields, event_ids, True)
+            body = (
+                '{"type": "FeatureCollection", "features": ' + features[0][0] + ', "next": ' + json.dumps(next_cursor) + '}'
+            ).encode()
+        else:
+            features = await db.run_sync(load_events, filters, fields, event_ids)
+            features = features[0][0] or []
+            if format == formats.COLUMNAR:
+                body = formats.to_columnar(features, next_cursor)
+            else:
+                # Arrow IPC or GeoParquet
+                encode = formats.to_arrow if format == formats.ARROW else formats.to_geoparquet
+                body = encode(features)
+                if next_cursor is not None:
+                    headers['X-Next-Cursor'] = next_cursor
+
+    packed = _pack_response(body, formats.MEDIA_TYPES[format] if zoom is None else "application/json", headers)
+    if key is not None:
+        await events_cache.set(key, packed)
+    return _unpack_response(packed, {'X-Cache': 'miss'})
+
+
+def _pack_response(body: bytes, media_type: str, headers: Dict[str, str]) -> bytes:
+    """Serialise a response for events_cache: a JSON line of media type and headers, then the body"""
+    return json.dumps([media_type, headers]).encode() + b'\n' + body
+
+
+def _unpack_response(packed: bytes, extra_headers: Dict[str, str]) -> Response:
+    head, body = packed.split(b'\n', 1)
+    media_type, headers = json.loads(head)
+    return Response(body, media_type=media_type, headers={**headers, **extra_headers})
+
+
+@app.get("/events/facets")
+async def event_facets(
+    filters: EventFilters = Depends(event_filters),
+    db: AsyncSession = Depends(get_read_db)):
+    """
+    Count events per value of each facet, under the same filters as /events.
+
+    A facet's counts ignore the filter on that facet itself, so values with
+    a count would return events if selected. Values with no events are omitted.
+    """
+    return FastJSONResponse(await db.run_sync(load_facet_counts, filters))
+
+
+
+@app.get("/events/histogram")
+async def event_histogram(
+    interval: Literal['year', 'month'] = 'year',
+    filters: EventFilters = Depends(event_filters),
+    db: AsyncSession = Depends(get_read_db)):
+    """
+    Count events per year, or per month, under the same filters as /events, e.g. for a time slider.
+
+    Returns bins in time order with `year`, `events` and, per month, `month`
+    (null for events without one). Years and months without events are omitted.
+    Served from the event_time_rollup table when the filters allow, see
+    db.load_event_histogram.
+    """
+    bins = await db.run_sync(load_event_histogram, filters, interval)
+    return FastJSONResponse({'interval': interval, 'bins': bins})
+
+@app.get("/events/tiles/{z}/{x}/{y}.mvt")
+async def event_tile(
+    z: int, x: int, y: int,
+    filters: EventFilters = Depends(event_filters),
+    db: AsyncSession = Depends(get_read_db)) -> Response:
+    """
+    Render the events in one web mercator tile as a Mapbox Vector Tile.
+
+    Accepts the same filters as /events. Each point only carries the
+    attributes listed in db.TILE_ATTRIBUTES.
+    """
+    if not 0 <= z <= MAX_TILE_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=404, detail="Tile out of range")
+
+    tile = await db.run_sync(load_event_tile, filters, z, x, y)
+    return Response(content=tile, media_type="application/vnd.mapbox-vector-tile")
+
+
+# Fields of each kind of stats POST /events/stats can load
+STATS_FIELDS = {'all': ALL_STATS_FIELDS, 'variant': VARIANT_STATS_FIELDS}
+
+
+class StatsRequest(BaseModel):
+    """Body of POST /events/stats"""
+    event_ids: List[str] | None = None
+    stats: List[Literal['all', 'variant']] = ['all', 'variant']
+
+
+@app.post("/events/stats")
+async def events_stats(
+    body: StatsRequest | None = None,
+    fields: str | None = None,
+    filters: EventFilters = Depends(event_filters),
+    db: AsyncSession = Depends(get_read_db)):
+    """
+    Load the stats for many events at once, grouped by event_id.
+
+    The events are the `event_ids` in the body or, without them, the events
+    matching the /events query parameters. Each kind of stats in `stats` is
+    loaded with one query for all events, rather than one per event.
+
+    `fields` may name columns of any requested kind; each kind returns those
+    it has, and is left out if it has none of them. Rows include event_id
+    only when it is one of the `fields`.
+    """
+    body = body or StatsRequest()
+    available = {name: column for kind in body.stats for name, column in STATS_FIELDS[kind].items()}
+    fields = _parse_fields(fields, available)
+
+    event_ids = body.event_ids
+    if event_ids is None:
+        # Only the ids are needed, which event_summary holds
+        event_ids = await db.run_sync(load_event_page, filters, EVENTS_MAX_PAGE_SIZE + 1, None, ['event_id'])
+    if len(event_ids) > EVENTS_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {EVENTS_MAX_PAGE_SIZE} events per request")
+
+    response = {event_id: {} for event_id in event_ids}
+
+    for kind, load in (('all', load_events_all_stats), ('variant', load_events_variant_stats)):
+        if kind not in body.stats:
+            continue
+        kind_fields = None if fields is None else [f for f in fields if f in STATS_FIELDS[kind]]
+        if kind_fields == []:
+            continue
+        kind_stats = await db.run_sync(load, event_ids, kind_fields)
+        for event_id, stats in response.items():
+            stats[f'{kind}_stats'] = kind_stats.get(event_id, [])
+
+    return FastJSONResponse(response)
+
+
+@app.get("/events/stats/aggregate")
+async def events_stats_aggregate(
+    group_by: str = 'phylum',
+    positions: Literal['all', 'variant'] = 'all',
+    stats: str | None = None,
+    filters: EventFilters = Depends(event_filters),
+    db: AsyncSession = Depends(get_read_db)):
+    """
+    Aggregate the populations summary stats of the events matching the /events filters.
+
+    Returns one entry per value of `group_by` (a taxon level, country or
+    continent_ocean) with, for each of the comma-delimited `stats`, the count,
+    mean, mean weighted by num_indiv, min and max over its populations.
+    `positions` picks the all-positions or variant-positions stats.
+    """
+    if group_by not in AGGREGATE_GROUPS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(AGGREGATE_GROUPS)}")
+    stats = _parse_fields(stats, AGGREGATE_STATS_FIELDS[positions], DEFAULT_AGGREGATE_STATS)
+    if stats is None:
+        stats = list(AGGREGATE_STATS_FIELDS[positions])
+
+    groups = await db.run_sync(load_stats_aggregates, filters, positions, group_by, stats)
+    return FastJSONResponse({'group_by': group_by, 'positions': positions, 'groups': groups})
 
 
 @app.get("/events/{event_id}/all_stats")
-def event_all_stats(event_id: str, db: Session = Depends(get_db)):
-    all_stats = load_event_all_stats(db, event_id)
+async def event_all_stats(event_id: str, fields: str | None = None, db: AsyncSession = Depends(get_read_db)):
+    fields = _parse_fields(fields, ALL_STATS_FIELDS)
+    all_stats = await db.run_sync(load_event_all_stats, event_id, fields)
     all_stats = [h._asdict() for h in all_stats]
-    return(all_stats)
+    return FastJSONResponse(all_stats)
 
 
 @app.get("/events/{event_id}/variant_stats")
-def event_variant_stats(event_id: str, db: Session = Depends(get_db)):
-    variant_stats = load_event_variant_stats(db, event_id)
+async def event_variant_stats(event_id: str, fields: str | None = None, db: AsyncSession = Depends(get_read_db)):
+    fields = _parse_fields(fields, VARIANT_STATS_FIELDS)
+    variant_stats = await db.run_sync(load_event_variant_stats, event_id, fields)
     variant_stats = [h._asdict() for h in variant_stats]
-    return(variant_stats)
+    return FastJSONResponse(variant_stats)
+
+
+
+# Most matches /search returns
+SEARCH_MAX_LIMIT = 50
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=2),
+    limit: int = Query(10, ge=1, le=SEARCH_MAX_LIMIT),
+    fields: str | None = None,
+    db: AsyncSession = Depends(get_read_db)):
+    """
+    Typeahead over taxonomy, colloquial names, countries and localities.
+
+    Returns up to `limit` matches of `q`, best first, each with the field it
+    is a value of and its number of events. `fields` limits the search to
+    some of SEARCH_FIELDS, comma-delimited. Fields that are /events filters
+    share their parameter name, so a match can be applied as a filter directly.
+    """
+    fields = _parse_fields(fields, dict.fromkeys(SEARCH_FIELDS))
+    results = await db.run_sync(search_terms, q.strip(), limit, fields)
+    if results is None:
+        raise HTTPException(status_code=503, detail="Search is not set up; run manage.py create-views")
+    return FastJSONResponse(results)
+
+@app.post("/exports", status_code=202)
+async def create_export(
+    format: Literal['csv', 'ndjson'] = 'csv',
+    stats: Literal['all', 'variant'] | None = None,
+    filters: EventFilters = Depends(event_filters)):
+    """
+    Start exporting every event matching the /events filters, as CSV or NDJSON.
+
+    The export runs in its own process, outside the API workers. Poll the
+    returned job at /exports/{id}, then fetch /exports/{id}/download once
+    its status is done. With `stats`, each sample is repeated per population
+    with its all-positions or variant-positions summary stats.
+    """
+    # Job files are read and written in the threadpool, so a full EXPORT_DIR does not stall the event loop
+    await run_in_threadpool(exports.remove_expired_jobs)
+    if await run_in_threadpool(exports.running_jobs) >= exports.EXPORT_MAX_RUNNING:
+        raise HTTPException(status_code=429, detail="Too many exports running, try again later")
+
+    job = await run_in_threadpool(exports.create_job, filters, format, stats)
+    try:
+        await exports.start_job(job)
+    except OSError as e:
+        job.update(status='failed', error=str(e))
+        await run_in_threadpool(exports.write_job, job)
+        raise HTTPException(status_code=500, detail="Could not start the export")
+
+    return FastJSONResponse(exports.job_status(job), status_code=202, headers={'Location': f"/exports/{job['id']}"})
+
+
+# Plain functions, which FastAPI runs in its threadpool, as they read job files
+
+@app.get("/exports/{job_id}")
+def get_export(job_id: str):
+    """Status and progress of an export: queued, running, done or failed, with the bytes written so far"""
+    job = exports.read_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    return FastJSONResponse(exports.job_status(job))
+
+
+@app.get("/exports/{job_id}/download")
+def download_export(job_id: str):
+    """The output of a finished export"""
+    job = exports.read_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    if job['status'] != 'done':
+        raise HTTPException(status_code=409, detail=f"Export is {job['status']}")
+    return FileResponse(
+        exports.artifact_path(job),
+        media_type=exports.MEDIA_TYPES[job['format']],
+        filename=f"events-{job['id']}.{job['format']}",
+    )
+
+async def _facet_response(request: Request, db: AsyncSession, helper: Callable) -> Response:
+    """
+    Respond with the cached value of a facet helper, or 304 if the client's copy is current.
+
+    If-None-Match takes precedence over If-Modified-Since, as in RFC 9110.
+    """
+    await facet_generation.check()
+    entry = await db.run_sync(helper.entry)
+    headers = {
+        'ETag': entry.etag,
+        'Last-Modified': formatdate(entry.last_modified, usegmt=True),
+    }
+
+    if_none_match = request.headers.get('if-none-match')
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_none_match is not None:
+        # Weak comparison, so tags a proxy marked weak (W/"...") still match
+        not_modified = if_none_match.strip() == '*' or \
+            entry.etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    elif if_modified_since is not None:
+        try:
+            not_modified = int(entry.last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            not_modified = False
+    else:
+        not_modified = False
+
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(entry.value, headers=headers)
+
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(x_admin_token: str | None = Header(None)):
+    """
+    Drop cached facet values and /events results, e.g. after a bulk data reload.
+
+    With EVENTS_CACHE_REDIS_URL set, every worker drops its facet values
+    within a second and the shared /events cache is flushed. Without it,
+    only the worker handling this request is flushed; the others keep
+    serving facets for up to FACET_CACHE_TTL (300 seconds by default) and
+    /events results for up to EVENTS_CACHE_TTL.
+
+    Returns {"facets": ..., "events": ...}, each true if that cache was
+    flushed everywhere it should be. False means Redis could not be
+    reached: the other workers' facets, or the remaining /events entries,
+    expire after their TTL instead.
+
+    Requires the X-Admin-Token header to match the CACHE_ADMIN_TOKEN
+    environment variable. The endpoint is disabled when that is not set.
+    """
+    expected = os.environ.get('CACHE_ADMIN_TOKEN')
+    if not expected or x_admin_token is None or not hmac.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    return FastJSONResponse({
+        'facets': await facet_generation.bump(),
+        'events': await events_cache.clear(),
+    })
+
+
+# Cached facet lists, filled by warm_up()
+FACET_HELPERS = (
+    unique_phylum, unique_class, unique_order, unique_family, unique_genus, unique_species,
+    unique_habitats, unique_environmental_medium, unique_establishment_means, year_range,
+)
 
 
 @app.get("/phylum")
-def get_phyla(db: Session = Depends(get_db)):
+async def get_phyla(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Get unique phyla in the database."""
-    return unique_phylum(db)
+    return await _facet_response(request, db, unique_phylum)
 
 @app.get("/taxonomic_class")
-def get_class(db: Session = Depends(get_db)):
+async def get_class(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Get unique taxonomic classes in the database."""
-    return unique_class(db)
+    return await _facet_response(request, db, unique_class)
 
 @app.get("/taxonomic_order")
-def get_order(db: Session = Depends(get_db)):
+async def get_order(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Get unique taxonomic orders in the database."""
-    return unique_order(db)
+    return await _facet_response(request, db, unique_order)
 
 @app.get("/family")
-def get_family(db: Session = Depends(get_db)):
+async def get_family(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Get unique taxonomic families in the database."""
-    return unique_family(db)
+    return await _facet_response(request, db, unique_family)
 
 @app.get("/genus")
-def get_genus(db: Session = Depends(get_db)):
+async def get_genus(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Get unique genera in the database."""
-    return unique_genus(db)
+    return await _facet_response(request, db, unique_genus)
 
 @app.get("/species")
-def get_species(db: Session = Depends(get_db)):
+async def get_species(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Get unique species in the database."""
-    return unique_species(db)
+    return await _facet_response(request, db, unique_species)
 
 @app.get("/environmental_medium")
-def get_environmental_medium(db: Session = Depends(get_db)):
+async def get_environmental_medium(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Get unique environmental media in the database."""
-    return unique_environmental_medium(db)
+    return await _facet_response(request, db, unique_environmental_medium)
 
 @app.get("/establishment_means")
-def get_establishment_means(db: Session = Depends(get_db)):
+async def get_establishment_means(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Get unique establishment means in the database."""
-    return unique_establishment_means(db)
+    return await _facet_response(request, db, unique_establishment_means)
 
 @app.get("/years")
-def get_years(db: Session = Depends(get_db)):
+async def get_years(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Return the min/max collection years in the database."""
-    return year_range(db)
+    return await _facet_response(request, db, year_range)
 
 @app.get("/habitat")
-def get_habitats(db: Session = Depends(get_db)):
+async def get_habitats(request: Request, db: AsyncSession = Depends(get_read_db)):
     """Return the min/max collection years in the database."""
-    return unique_habitats(db)
+    return await _facet_response(request, db, unique_habitats)
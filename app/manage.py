@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Command line tools for maintaining the database.
+
+Usage: python manage.py <command>
+"""
+
+import argparse
+import sys
+
+from database import engine
+from exports import FORMATS, copy_export, run_job
+from filters import BBOX_PARAMS, LIST_FILTERS, EventFilters
+from schema import create_indexes, create_rollups, create_views, rebuild_rollups, refresh_views
+
+
+def cmd_create_indexes(args: argparse.Namespace):
+    with engine.begin() as conn:
+        create_indexes(conn)
+
+
+def cmd_create_views(args: argparse.Namespace):
+    with engine.begin() as conn:
+        create_views(conn)
+
+
+def cmd_refresh_views(args: argparse.Namespace):
+    with engine.begin() as conn:
+        refresh_views(conn)
+
+
+def cmd_create_rollups(args: argparse.Namespace):
+    with engine.begin() as conn:
+        create_rollups(conn)
+
+
+def cmd_rebuild_rollups(args: argparse.Namespace):
+    with engine.begin() as conn:
+        rebuild_rollups(conn)
+
+
+def cmd_export(args: argparse.Namespace):
+    if args.job:
+        run_job(engine, args.job)
+        return
+
+    with engine.connect() as conn:
+        params = {name: getattr(args, name).split(',') for name in LIST_FILTERS if getattr(args, name)}
+        if args.bbox:
+            params.update(zip(BBOX_PARAMS, args.bbox))
+        filters = EventFilters.create(**params, min_year=args.min_year, max_year=args.max_year)
+
+        if args.output == '-':
+            copy_export(conn, filters, args.format, args.stats, sys.stdout.buffer)
+        else:
+            with open(args.output, 'wb') as out:
+                rows = copy_export(conn, filters, args.format, args.stats, out)
+            print(f"Exported {rows} rows to {args.output}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create-indexes", help="create the indexes used by the API queries")
+    create.set_defaults(func=cmd_create_indexes)
+
+    views = commands.add_parser("create-views", help="create the materialized views read by the API")
+    views.set_defaults(func=cmd_create_views)
+
+    refresh = commands.add_parser("refresh-views", help="reload the materialized views after a data import")
+    refresh.set_defaults(func=cmd_refresh_views)
+
+    rollups = commands.add_parser("create-rollups", help="create the rollup tables and the triggers that maintain them")
+    rollups.set_defaults(func=cmd_create_rollups)
+
+    rebuild = commands.add_parser("rebuild-rollups", help="recount the rollup tables, e.g. after loading with triggers disabled")
+    rebuild.set_defaults(func=cmd_rebuild_rollups)
+
+    export = commands.add_parser("export", help="write the events matching the filters as CSV or NDJSON")
+    export.add_argument("--format", choices=FORMATS, default="csv")
+    export.add_argument("--stats", choices=["all", "variant"], help="add the populations summary stats of each sample")
+    export.add_argument("--output", default="-", help="file to write, or - for stdout (the default)")
+    export.add_argument("--job", help="run this export job queued by the API, ignoring the other options")
+    for name in LIST_FILTERS:
+        export.add_argument(f"--{name.replace('_', '-')}", dest=name, help="comma-delimited values")
+    export.add_argument("--bbox", type=float, nargs=4, metavar=("MIN_LNG", "MIN_LAT", "MAX_LNG", "MAX_LAT"))
+    export.add_argument("--min-year", type=int)
+    export.add_argument("--max-year", type=int)
+    export.set_defaults(func=cmd_export)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Request and query instrumentation, exposed in the Prometheus text format.
+
+MetricsMiddleware times each request and counts the bytes sent, labelled by
+route template. instrument_engine() hooks SQLAlchemy cursor events to time
+each statement and count its rows, and attributes them to the request that
+ran it. Statements slower than SLOW_QUERY_MS milliseconds are logged.
+instrument_sessions() times the wait for a pooled connection.
+
+Metrics are kept per process; with several workers, scrape each one.
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Engine, event
+
+
+logger = logging.getLogger(__name__)
+
+# Log statements slower than this many milliseconds; 0 disables the log
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
+
+# Histogram buckets in seconds, from 1 ms to 30 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Histogram buckets in bytes, from 1 KB to 100 MB
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label set: a count per bucket plus one for +Inf, and the sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{self.name}_bucket{_labels(self.labels + ("le",), key + (le,))} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, key)} {total[0]}')
+                lines.append(f'{self.name}_count{_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """Values read when the metrics are scraped. `read` returns a value per tuple of label values."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], read: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name, self.help, self.labels, self.read = name, help, tuple(labels), read
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for key, value in sorted(self.read().items()):
+            lines.append(f'{self.name}{_labels(self.labels, key)} {value}')
+        return lines
+
+
+REGISTRY: List = []
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+REQUEST_SECONDS = register(Histogram(
+    'http_request_duration_seconds', 'Time from receiving a request to sending the last byte of the response',
+    ('method', 'route', 'status'),
+))
+RESPONSE_BYTES = register(Histogram(
+    'http_response_size_bytes', 'Bytes in the response body, after compression', ('route',), SIZE_BUCKETS,
+))
+REQUEST_DB_SECONDS = register(Histogram(
+    'http_request_db_seconds', 'Time spent executing statements per request', ('route',),
+))
+QUERY_SECONDS = register(Histogram(
+    'db_query_duration_seconds', 'Time to execute one statement, until its first rows are available', ('route',),
+))
+QUERY_ROWS = register(Counter(
+    'db_rows_total', 'Rows returned by statements (not counted for server-side cursors)', ('route',),
+))
+POOL_CHECKOUT_SECONDS = register(Histogram(
+    'db_pool_checkout_seconds', 'Time a request waited for a database connection from the pool',
+))
+
+
+# Connection pools of the instrumented engines, by name
+_pools: Dict[str, Any] = {}
+
+register(Gauge(
+    'db_pool_connections_checked_out', 'Connections currently in use', ('engine',),
+    lambda: {(name,): pool.checkedout() for name, pool in _pools.items()},
+))
+register(Gauge(
+    'db_pool_connections_idle', 'Connections open and waiting in the pool', ('engine',),
+    lambda: {(name,): pool.checkedin() for name, pool in _pools.items()},
+))
+
+
+@dataclass
+class RequestStats:
+    scope: Optional[dict] = None
+    queries: int = 0
+    db_seconds: float = 0.0
+
+    @property
+    def route(self) -> str:
+        """The matched route template, e.g. /events/{event_id}/all_stats, rather than the raw path"""
+        if self.scope is None:
+            return 'none'
+        route = self.scope.get('route')
+        return route.path if route is not None else 'unmatched'
+
+
+# Stats of the request being handled. Statements run outside a request are attributed to 'none'.
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def instrument_engine(engine: Engine, name: str):
+    """
+    Time every statement run through `engine`, and report its pool usage labelled `name`.
+
+    Pass async_engine.sync_engine for an async engine. Call once per engine and process.
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        stats = _request_stats.get() or RequestStats()
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+        QUERY_SECONDS.observe(elapsed, route=stats.route)
+        if cursor.rowcount > 0:
+            QUERY_ROWS.inc(cursor.rowcount, route=stats.route)
+
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            logger.warning("Slow query (%.0f ms) for %s: %s", elapsed * 1000, stats.route, ' '.join(statement.split()))
+
+    _pools[name] = engine.pool
+
+
+def instrument_sessions(session_class: type):
+    """
+    Time how long sessions of `session_class` wait for a pooled connection.
+
+    Sessions take a connection on their first statement, so a request that
+    runs no statements, e.g. one served from a cache, never waits for one.
+    """
+
+    @event.listens_for(session_class, 'do_orm_execute')
+    def do_orm_execute(state):
+        if not state.session.in_transaction():
+            state.session.info['checkout_started'] = time.perf_counter()
+
+    @event.listens_for(session_class, 'after_begin')
+    def after_begin(session, transaction, connection):
+        started = session.info.pop('checkout_started', None)
+        if started is not None:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency, response size and database time.
+
+    Also adds a Server-Timing header with the database time spent before the
+    response started, so browsers' developer tools show it per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                server_timing = 'db;dur={:.1f};desc="{} queries", app;dur={:.1f}'.format(
+                    stats.db_seconds * 1000, stats.queries, (time.perf_counter() - started) * 1000
+                )
+                message = {**message, 'headers': list(message.get('headers', [])) + [
+                    (b'server-timing', server_timing.encode()),
+                ]}
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope['method'], route=stats.route, status=str(status))
+            RESPONSE_BYTES.observe(size, route=stats.route)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, route=stats.route)
+
+
+def render() -> bytes:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return ('\n'.join(lines) + '\n').encode()
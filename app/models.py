@@ -3,11 +3,15 @@
 from typing import Optional
 
 from geoalchemy2 import Geometry
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from sqlalchemy.dialects.postgresql import CHAR, NUMERIC, TEXT
 
 
+# Spatial reference of event_metadata.geom (WGS 84 longitude/latitude)
+SRID = 4326
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -76,7 +80,7 @@ class EventMetadata(Base):
     sampling_protocol: Mapped[Optional[str]] = mapped_column(TEXT)
     state_province: Mapped[Optional[str]] = mapped_column(TEXT)
     year_collected: Mapped[int]
-    geom = Column(Geometry('POINT'))
+    geom = Column(Geometry('POINT', srid=SRID))
 
 class SampleMetadata(Base):
     __tablename__ = "sample_metadata"
@@ -112,7 +116,7 @@ class StacksRuns(Base):
 
     stacks_run_id: Mapped[int] = mapped_column(primary_key=True)
     stacks_run_name: Mapped[str] = mapped_column(TEXT)
-    dataset_name: Mapped[str] = mapped_column(TEXT, ForeignKey("dataseta.dataset_name"))
+    dataset_name: Mapped[str] = mapped_column(TEXT, ForeignKey("datasets.dataset_name"))
     little_m: Mapped[int]
     big_m: Mapped[int]
     n: Mapped[int]
@@ -240,3 +244,85 @@ class PopulationsSumStatsSummaryAllPositions(Base):
     fis: Mapped[float] = mapped_column(NUMERIC)
     fis_var: Mapped[float] = mapped_column(NUMERIC)
     fix_stderr: Mapped[float] = mapped_column(NUMERIC)
+
+class EventSummary(Base):
+    """
+    ORM wrapper for the event_summary materialized view (see schema.py).
+    One row per sample, holding the event and sample columns the API filters on and displays.
+    """
+    __tablename__ = "event_summary"
+    __table_args__ = {'info': {'materialized_view': True}}
+
+    sample_bcid: Mapped[str] = mapped_column(TEXT, primary_key=True)
+    event_id: Mapped[str] = mapped_column(TEXT)
+    phylum: Mapped[Optional[str]] = mapped_column(TEXT)
+    taxonomic_class: Mapped[Optional[str]] = mapped_column(TEXT, name="class")
+    taxonomic_order: Mapped[Optional[str]] = mapped_column(TEXT)
+    family: Mapped[Optional[str]] = mapped_column(TEXT)
+    genus: Mapped[Optional[str]] = mapped_column(TEXT)
+    specific_epithet: Mapped[Optional[str]] = mapped_column(TEXT)
+    colloquial_name: Mapped[Optional[str]] = mapped_column(TEXT)
+    establishment_means: Mapped[Optional[str]] = mapped_column(TEXT)
+    habitat: Mapped[Optional[str]] = mapped_column(TEXT)
+    country: Mapped[Optional[str]] = mapped_column(TEXT)
+    continent_ocean: Mapped[Optional[str]] = mapped_column(TEXT)
+    environmental_medium: Mapped[Optional[str]] = mapped_column(TEXT)
+    state_province: Mapped[Optional[str]] = mapped_column(TEXT)
+    locality: Mapped[str] = mapped_column(TEXT)
+    decimal_latitude: Mapped[Optional[float]] = mapped_column(NUMERIC)
+    decimal_longitude: Mapped[Optional[float]] = mapped_column(NUMERIC)
+    year_collected: Mapped[int]
+    month_collected: Mapped[Optional[int]]
+    day_collected: Mapped[Optional[int]]
+    geom = Column(Geometry('POINT', srid=SRID))
+
+class EventStacksRuns(Base):
+    """
+    ORM wrapper for the event_stacks_runs materialized view (see schema.py).
+    One row per event and stacks run holding its populations summary stats.
+    """
+    __tablename__ = "event_stacks_runs"
+    __table_args__ = {'info': {'materialized_view': True}}
+
+    event_id: Mapped[str] = mapped_column(TEXT, primary_key=True)
+    stacks_run_id: Mapped[int] = mapped_column(primary_key=True)
+    dataset_name: Mapped[str] = mapped_column(TEXT)
+
+class SearchTerms(Base):
+    """
+    ORM wrapper for the search_terms materialized view (see schema.py).
+    One row per distinct value of each searchable column, with the number of events having it.
+    """
+    __tablename__ = "search_terms"
+    __table_args__ = {'info': {'materialized_view': True}}
+
+    field: Mapped[str] = mapped_column(TEXT, primary_key=True)
+    value: Mapped[str] = mapped_column(TEXT, primary_key=True)
+    events: Mapped[int]
+
+class EventTimeRollup(Base):
+    """
+    ORM wrapper for the event_time_rollup table, kept up to date by triggers on event_metadata (see schema.py).
+    One row per combination of the event columns below, with its number of events. Missing text values are
+    stored as '' and a missing month as 0, so the combination is unique.
+    """
+    __tablename__ = "event_time_rollup"
+    __table_args__ = (
+        UniqueConstraint(
+            'year_collected', 'month_collected', 'country', 'continent_ocean', 'habitat', 'environmental_medium',
+            'cell_lng', 'cell_lat', name='event_time_rollup_key'
+        ),
+        {'info': {'rollup': True}},
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    year_collected: Mapped[int]
+    month_collected: Mapped[int]
+    country: Mapped[str] = mapped_column(TEXT)
+    continent_ocean: Mapped[str] = mapped_column(TEXT)
+    habitat: Mapped[str] = mapped_column(TEXT)
+    environmental_medium: Mapped[str] = mapped_column(TEXT)
+    # South-west corner of the schema.ROLLUP_CELL_DEGREES grid cell holding the event
+    cell_lng: Mapped[int]
+    cell_lat: Mapped[int]
+    events: Mapped[int]
@@ -0,0 +1,91 @@
+"""
+Routing of read-only queries across replica databases.
+
+ReplicaRouter hands out replica engines round-robin, skipping any replica
+that is unreachable or lags the primary by more than max_lag seconds, and
+falls back to the primary when no replica is usable. Health is refreshed by
+monitor(), which runs for the life of each worker. A replica is not used
+until its first check passes.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.sql import text
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds since the last replayed transaction, or 0 when everything received has been replayed.
+# A primary (not in recovery) reports 0.
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+@dataclass
+class Replica:
+    name: str
+    engine: AsyncEngine
+    # Unchecked replicas may be lagging or unreachable, so reads go to the primary until the first check
+    healthy: bool = False
+    lag: Optional[float] = None
+    checked: Optional[float] = None
+    error: Optional[str] = None
+
+    def status(self) -> Dict[str, Any]:
+        return {'host': self.name, 'healthy': self.healthy, 'lag_seconds': self.lag, 'error': self.error}
+
+
+@dataclass
+class ReplicaRouter:
+    primary: AsyncEngine
+    replicas: List[Replica] = field(default_factory=list)
+    max_lag: float = 30
+    check_interval: float = 10
+
+    def __post_init__(self):
+        self._next = itertools.cycle(range(len(self.replicas))) if self.replicas else None
+
+    def engines(self) -> List[AsyncEngine]:
+        return [self.primary] + [replica.engine for replica in self.replicas]
+
+    def choose(self) -> AsyncEngine:
+        """The next healthy replica in turn, or the primary if there is none"""
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next)]
+            if replica.healthy:
+                return replica.engine
+        return self.primary
+
+    async def check(self, replica: Replica):
+        try:
+            async with replica.engine.connect() as conn:
+                replica.lag = float((await conn.execute(LAG_QUERY)).scalar())
+            replica.error = None
+            healthy = replica.lag <= self.max_lag
+        except Exception as e:
+            replica.lag, replica.error = None, str(e).splitlines()[0]
+            healthy = False
+        if healthy != replica.healthy:
+            logger.warning("Replica %s is now %s (lag %s, %s)", replica.name,
+                           "in use" if healthy else "skipped", replica.lag, replica.error or "no error")
+        replica.healthy = healthy
+        replica.checked = time.time()
+
+    async def monitor(self):
+        """Check every replica each check_interval seconds, until cancelled"""
+        while True:
+            await asyncio.gather(*[self.check(replica) for replica in self.replicas])
+            await asyncio.sleep(self.check_interval)
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [replica.status() for replica in self.replicas]
@@ -0,0 +1,32 @@
+"""
+JSON responses that skip FastAPI's jsonable_encoder.
+
+Endpoints return these directly so FastAPI does not walk the content before
+it is encoded. FastJSONResponse encodes with orjson. JSON text that is
+already encoded, e.g. built by Postgres, goes out in a plain Response.
+"""
+
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import Response
+
+
+def _default(value: Any) -> Any:
+    # NUMERIC columns come back from psycopg as Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Encode `content` as JSON with orjson. Dates and datetimes are written in ISO 8601."""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
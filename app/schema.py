@@ -0,0 +1,318 @@
+"""
+Database objects managed by this app, on top of the tables described in models.py.
+
+Each statement is idempotent so the setup can be re-run safely after a data load.
+"""
+
+from typing import List
+
+from sqlalchemy import Connection
+from sqlalchemy.sql import text
+
+from models import SRID, Base, EventTimeRollup
+
+
+INDEXES: List[str] = [
+    # Bounding box filters in db.load_events use && on geom
+    "CREATE INDEX IF NOT EXISTS event_metadata_geom_idx ON event_metadata USING GIST (geom)",
+    # Stats helpers join datasets to their stacks run, then the run to its populations summary stats
+    "CREATE INDEX IF NOT EXISTS stacks_runs_dataset_name_idx ON stacks_runs (dataset_name, stacks_run_name)",
+    "CREATE INDEX IF NOT EXISTS populations_sumstats_summary_all_positions_stacks_run_id_idx"
+    " ON populations_sumstats_summary_all_positions (stacks_run_id)",
+    "CREATE INDEX IF NOT EXISTS populations_sumstats_summary_variant_positions_stacks_run_id_idx"
+    " ON populations_sumstats_summary_variant_positions (stacks_run_id)",
+]
+
+# Tables whose planner statistics are refreshed after creating the indexes
+ANALYZE_TABLES: List[str] = [
+    "event_metadata",
+    "stacks_runs",
+    "populations_sumstats_summary_all_positions",
+    "populations_sumstats_summary_variant_positions",
+]
+
+# Denormalized event/sample rows read by db.load_events when present.
+# Keep the column list in sync with models.EventSummary.
+EVENT_SUMMARY = """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS event_summary AS
+    SELECT
+        sample_metadata.sample_bcid,
+        event_metadata.event_id,
+        sample_metadata.phylum,
+        sample_metadata.class,
+        sample_metadata.taxonomic_order,
+        sample_metadata.family,
+        sample_metadata.genus,
+        sample_metadata.specific_epithet,
+        sample_metadata.colloquial_name,
+        sample_metadata.establishment_means,
+        event_metadata.habitat,
+        event_metadata.country,
+        event_metadata.continent_ocean,
+        event_metadata.environmental_medium,
+        event_metadata.state_province,
+        event_metadata.locality,
+        event_metadata.decimal_latitude,
+        event_metadata.decimal_longitude,
+        event_metadata.year_collected,
+        event_metadata.month_collected,
+        event_metadata.day_collected,
+        event_metadata.geom
+    FROM event_metadata
+    JOIN sample_metadata USING (event_id)
+"""
+
+EVENT_SUMMARY_INDEXES: List[str] = [
+    # A unique index is required for REFRESH MATERIALIZED VIEW CONCURRENTLY
+    "CREATE UNIQUE INDEX IF NOT EXISTS event_summary_sample_bcid_idx ON event_summary (sample_bcid)",
+    "CREATE INDEX IF NOT EXISTS event_summary_event_id_idx ON event_summary (event_id)",
+    "CREATE INDEX IF NOT EXISTS event_summary_phylum_idx ON event_summary (phylum)",
+    "CREATE INDEX IF NOT EXISTS event_summary_class_idx ON event_summary (class)",
+    "CREATE INDEX IF NOT EXISTS event_summary_taxonomic_order_idx ON event_summary (taxonomic_order)",
+    "CREATE INDEX IF NOT EXISTS event_summary_family_idx ON event_summary (family)",
+    "CREATE INDEX IF NOT EXISTS event_summary_genus_idx ON event_summary (genus)",
+    "CREATE INDEX IF NOT EXISTS event_summary_specific_epithet_idx ON event_summary (specific_epithet)",
+    "CREATE INDEX IF NOT EXISTS event_summary_country_idx ON event_summary (country)",
+    "CREATE INDEX IF NOT EXISTS event_summary_year_collected_idx ON event_summary (year_collected)",
+    "CREATE INDEX IF NOT EXISTS event_summary_geom_idx ON event_summary USING GIST (geom)",
+]
+
+# The stacks run of each event's dataset (the one named by datasets.r80), so
+# the stats helpers in db.py can go from an event to its stats by stacks_run_id.
+# Keep the column list in sync with models.EventStacksRuns.
+EVENT_STACKS_RUNS = """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS event_stacks_runs AS
+    SELECT DISTINCT
+        sample_metadata.event_id,
+        stacks_runs.stacks_run_id,
+        datasets.dataset_name
+    FROM sample_metadata
+    JOIN datasets USING (dataset_name)
+    JOIN stacks_runs ON (stacks_runs.stacks_run_name = datasets.r80 AND stacks_runs.dataset_name = datasets.dataset_name)
+"""
+
+EVENT_STACKS_RUNS_INDEXES: List[str] = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS event_stacks_runs_event_id_idx ON event_stacks_runs (event_id, stacks_run_id)",
+    "CREATE INDEX IF NOT EXISTS event_stacks_runs_stacks_run_id_idx ON event_stacks_runs (stacks_run_id)",
+]
+
+# Distinct values of the columns /search looks in, with their event counts.
+# Fields are named like the /events filter parameters where there is one.
+# Keep the column list in sync with models.SearchTerms.
+SEARCH_TERMS = """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS search_terms AS
+    SELECT field, value, count(DISTINCT event_id) AS events
+    FROM (
+        SELECT 'phylum' AS field, phylum AS value, event_id FROM sample_metadata
+        UNION ALL SELECT 'taxonomic_class', class, event_id FROM sample_metadata
+        UNION ALL SELECT 'taxonomic_order', taxonomic_order, event_id FROM sample_metadata
+        UNION ALL SELECT 'family', family, event_id FROM sample_metadata
+        UNION ALL SELECT 'genus', genus, event_id FROM sample_metadata
+        UNION ALL SELECT 'species', specific_epithet, event_id FROM sample_metadata
+        UNION ALL SELECT 'colloquial_name', colloquial_name, event_id FROM sample_metadata
+        UNION ALL SELECT 'country', country, event_id FROM event_metadata
+        UNION ALL SELECT 'locality', locality, event_id FROM event_metadata
+    ) terms
+    WHERE value IS NOT NULL AND value <> ''
+    GROUP BY field, value
+"""
+
+SEARCH_TERMS_INDEXES: List[str] = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS search_terms_field_value_idx ON search_terms (field, value)",
+    # Substring (ILIKE) and word similarity (<%) matches in db.search_terms
+    "CREATE INDEX IF NOT EXISTS search_terms_value_trgm_idx ON search_terms USING GIN (value gin_trgm_ops)",
+]
+
+# Extensions the views' indexes need
+EXTENSIONS: List[str] = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+]
+
+# Materialized views, with the indexes created along with each
+VIEWS = [
+    ("event_summary", EVENT_SUMMARY, EVENT_SUMMARY_INDEXES),
+    ("event_stacks_runs", EVENT_STACKS_RUNS, EVENT_STACKS_RUNS_INDEXES),
+    ("search_terms", SEARCH_TERMS, SEARCH_TERMS_INDEXES),
+]
+
+# Width in whole degrees of the grid cells event_time_rollup counts events in.
+# Bounding boxes are widened to this grid when the histogram reads the rollup.
+ROLLUP_CELL_DEGREES = 1
+
+# The event_time_rollup key of an event_metadata row. Events without a geom go
+# in a cell outside any bounding box.
+_ROLLUP_KEY = ", ".join([
+    "year_collected",
+    "COALESCE(month_collected, 0)",
+    "COALESCE(country, '')",
+    "COALESCE(continent_ocean, '')",
+    "COALESCE(habitat, '')",
+    "COALESCE(environmental_medium, '')",
+    f"COALESCE(floor(ST_X(geom) / {ROLLUP_CELL_DEGREES}) * {ROLLUP_CELL_DEGREES}, -1000)",
+    f"COALESCE(floor(ST_Y(geom) / {ROLLUP_CELL_DEGREES}) * {ROLLUP_CELL_DEGREES}, -1000)",
+])
+
+_ROLLUP_COLUMNS = "year_collected, month_collected, country, continent_ocean, habitat, environmental_medium, cell_lng, cell_lat, events"
+
+def _has_samples(events: str) -> str:
+    """Condition that the event_metadata row `events` has samples, as the joins in filters.events_query require"""
+    return f"EXISTS (SELECT 1 FROM sample_metadata WHERE sample_metadata.event_id = {events}.event_id)"
+
+def _rollup_apply(events: str, sign: int) -> str:
+    """Add the event_metadata rows selected by `events` to event_time_rollup, or subtract them with sign -1"""
+    return f"""
+            INSERT INTO event_time_rollup AS rollup ({_ROLLUP_COLUMNS})
+            SELECT {_ROLLUP_KEY}, {sign} * count(*) FROM ({events}) AS events GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+            ON CONFLICT ON CONSTRAINT event_time_rollup_key DO UPDATE SET events = rollup.events + EXCLUDED.events;"""
+
+# Events of changed samples that had samples before the statement and have none now
+_LOST_SAMPLES = f"""
+    SELECT * FROM event_metadata
+    WHERE event_id IN (SELECT event_id FROM old_rows) AND NOT {_has_samples('event_metadata')}"""
+
+# Events of changed samples whose only samples now are the new rows
+_GAINED_SAMPLES = """
+    SELECT * FROM event_metadata
+    WHERE event_id IN (SELECT event_id FROM new_rows) AND NOT EXISTS (
+        SELECT 1 FROM sample_metadata
+        WHERE sample_metadata.event_id = event_metadata.event_id
+        AND sample_metadata.sample_bcid NOT IN (SELECT sample_bcid FROM new_rows)
+    )"""
+
+# ...that did not have samples among the rows an update replaced either
+_GAINED_SAMPLES_ON_UPDATE = _GAINED_SAMPLES + """
+    AND NOT EXISTS (SELECT 1 FROM old_rows WHERE old_rows.event_id = event_metadata.event_id)"""
+
+# Statement level triggers, so a bulk load updates each rollup row once rather than once per event.
+# Only events with samples are counted, so those on sample_metadata count an event from its first
+# sample and drop it with its last.
+ROLLUP_TRIGGERS: List[str] = [
+    f"""
+    CREATE OR REPLACE FUNCTION event_time_rollup_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN{_rollup_apply(f"SELECT * FROM old_rows WHERE {_has_samples('old_rows')}", -1)}
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN{_rollup_apply(f"SELECT * FROM new_rows WHERE {_has_samples('new_rows')}", 1)}
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION event_time_rollup_apply_samples() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN{_rollup_apply(_GAINED_SAMPLES, 1)}
+        ELSIF TG_OP = 'UPDATE' THEN{_rollup_apply(_LOST_SAMPLES, -1)}{_rollup_apply(_GAINED_SAMPLES_ON_UPDATE, 1)}
+        ELSE{_rollup_apply(_LOST_SAMPLES, -1)}
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+]
+
+for _table, _function in (('event_metadata', 'event_time_rollup_apply'), ('sample_metadata', 'event_time_rollup_apply_samples')):
+    ROLLUP_TRIGGERS += [
+        f"DROP TRIGGER IF EXISTS event_time_rollup_insert ON {_table}",
+        f"""
+    CREATE TRIGGER event_time_rollup_insert AFTER INSERT ON {_table}
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {_function}()
+    """,
+        f"DROP TRIGGER IF EXISTS event_time_rollup_update ON {_table}",
+        f"""
+    CREATE TRIGGER event_time_rollup_update AFTER UPDATE ON {_table}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {_function}()
+    """,
+        f"DROP TRIGGER IF EXISTS event_time_rollup_delete ON {_table}",
+        f"""
+    CREATE TRIGGER event_time_rollup_delete AFTER DELETE ON {_table}
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {_function}()
+    """,
+    ]
+
+ROLLUP_INDEXES: List[str] = [
+    # The triggers look up the samples of changed events
+    "CREATE INDEX IF NOT EXISTS sample_metadata_event_id_idx ON sample_metadata (event_id)",
+    "CREATE INDEX IF NOT EXISTS event_time_rollup_cell_idx ON event_time_rollup (cell_lng, cell_lat)",
+]
+
+
+def create_tables(conn: Connection):
+    """Create the tables described in models.py, skipping the materialized views and rollups."""
+    tables = [
+        t for t in Base.metadata.sorted_tables
+        if not t.info.get('materialized_view') and not t.info.get('rollup')
+    ]
+    Base.metadata.create_all(conn, tables=tables)
+
+
+def check_srid(conn: Connection):
+    """
+    Fail unless event_metadata.geom has the SRID the queries build boxes in (models.SRID).
+
+    With any other SRID, including 0 for none, every bounding box and tile
+    query fails with a mixed SRID error.
+    """
+    srid = conn.execute(text("SELECT Find_SRID(current_schema(), 'event_metadata', 'geom')")).scalar()
+    if srid != SRID:
+        raise RuntimeError(
+            f"event_metadata.geom has SRID {srid} but the API queries use {SRID}. Convert it with "
+            f"ALTER TABLE event_metadata ALTER COLUMN geom TYPE geometry(Point, {SRID}) "
+            f"USING ST_Transform(geom, {SRID}), or ST_SetSRID(geom, {SRID}) if it has no SRID."
+        )
+
+
+def create_indexes(conn: Connection):
+    """Check the geometry SRID, create the indexes the query helpers rely on, then refresh planner statistics."""
+    check_srid(conn)
+    for statement in INDEXES:
+        conn.execute(text(statement))
+    for table in ANALYZE_TABLES:
+        conn.execute(text(f"ANALYZE {table}"))
+
+
+def create_views(conn: Connection):
+    """Create and populate the materialized views, with their indexes."""
+    for statement in EXTENSIONS:
+        conn.execute(text(statement))
+    for name, view, indexes in VIEWS:
+        conn.execute(text(view))
+        for statement in indexes:
+            conn.execute(text(statement))
+        conn.execute(text(f"ANALYZE {name}"))
+
+
+def refresh_views(conn: Connection):
+    """Reload the materialized views from the base tables, e.g. after a bulk import."""
+    for name, view, indexes in VIEWS:
+        conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"))
+        conn.execute(text(f"ANALYZE {name}"))
+
+
+def create_rollups(conn: Connection):
+    """Create the rollup tables and the triggers maintaining them, then fill them."""
+    EventTimeRollup.__table__.create(conn, checkfirst=True)
+    for statement in ROLLUP_INDEXES + ROLLUP_TRIGGERS:
+        conn.execute(text(statement))
+    rebuild_rollups(conn)
+
+
+def rebuild_rollups(conn: Connection):
+    """
+    Recount the rollup tables from the base tables.
+
+    Only needed when the triggers were bypassed, e.g. disabled for a bulk
+    load. Locks event_metadata and sample_metadata against writes while it runs.
+    """
+    conn.execute(text("LOCK TABLE event_metadata, sample_metadata IN SHARE MODE"))
+    conn.execute(text("TRUNCATE event_time_rollup"))
+    conn.execute(text(f"""
+        INSERT INTO event_time_rollup ({_ROLLUP_COLUMNS})
+        SELECT {_ROLLUP_KEY}, count(*) FROM event_metadata
+        WHERE {_has_samples('event_metadata')}
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+    """))
+    conn.execute(text("ANALYZE event_time_rollup"))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Print the EXPLAIN ANALYZE plan of every query the db.py helpers run.
+
+Each helper is called with representative arguments on a synchronous
+session. Every statement it sends is first run under
+EXPLAIN (ANALYZE, BUFFERS) on the same connection and the plan recorded,
+then run normally so the helper gets its rows. Statements therefore run
+twice, so caches are warm for the timed run.
+
+Connects with the same PG* environment variables as the app.
+
+Usage: python3 benchmarks/explain.py [--only load_events] [--output plans.txt]
+"""
+
+import argparse
+import os
+import sys
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from sqlalchemy import event, select
+
+import db
+from database import SessionLocal, engine
+from filters import DEFAULT_EVENT_FIELDS, EventFilters
+from models import EventMetadata
+from vocabulary import *
+
+
+@contextmanager
+def capture_plans(plans):
+    """Record (statement, plan lines) for each statement run while inside the block"""
+
+    def explain(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+            plans.append((statement, [row[0] for row in cursor.fetchall()]))
+        return statement, parameters
+
+    event.listen(engine, "before_cursor_execute", explain, retval=True)
+    try:
+        yield
+    finally:
+        event.remove(engine, "before_cursor_execute", explain)
+
+
+def cases(session):
+    """(name, call) for each helper, with filters that match part of the seeded data"""
+    lng, lat = CENTRES[0]
+    bbox = EventFilters.create(min_lng=lng - 5, min_lat=lat - 5, max_lng=lng + 5, max_lat=lat + 5)
+    filtered = EventFilters.create(
+        min_lng=lng - 20, min_lat=lat - 10, max_lng=lng + 20, max_lat=lat + 10,
+        phylum=PHYLA[:2], min_year=2000, max_year=2010,
+    )
+    antimeridian = EventFilters.create(min_lng=170, min_lat=-30, max_lng=-170, max_lat=0)
+    unfiltered = EventFilters.create()
+
+    event_ids = list(session.execute(
+        select(EventMetadata.event_id).order_by(EventMetadata.event_id).limit(100)
+    ).scalars())
+
+    return [
+        ('load_event_page bbox', lambda: db.load_event_page(session, bbox, 1000, None, DEFAULT_EVENT_FIELDS)),
+        ('load_event_page filtered', lambda: db.load_event_page(session, filtered, 1000, None, DEFAULT_EVENT_FIELDS)),
+        ('load_event_page antimeridian', lambda: db.load_event_page(session, antimeridian, 1000, None, DEFAULT_EVENT_FIELDS)),
+        ('load_event_page deep', lambda: db.load_event_page(session, unfiltered, 1000, event_ids[-1], DEFAULT_EVENT_FIELDS)),
+        ('load_events default fields', lambda: db.load_events(session, bbox, DEFAULT_EVENT_FIELDS, event_ids, True)),
+        ('load_events all fields', lambda: db.load_events(session, bbox, None, event_ids, True)),
+        ('load_facet_counts', lambda: db.load_facet_counts(session, filtered)),
+        ('load_event_clusters zoom 3', lambda: db.load_event_clusters(session, unfiltered, 3, 'phylum', True)),
+        ('load_event_clusters zoom 8', lambda: db.load_event_clusters(session, bbox, 8, 'taxonomic_class', True)),
+        ('load_event_tile 4/4/6', lambda: db.load_event_tile(session, unfiltered, 4, 4, 6)),
+        ('load_event_all_stats', lambda: db.load_event_all_stats(session, event_ids[0])),
+        ('load_event_variant_stats', lambda: db.load_event_variant_stats(session, event_ids[0])),
+        ('load_events_all_stats', lambda: db.load_events_all_stats(session, event_ids)),
+        ('load_events_variant_stats', lambda: db.load_events_variant_stats(session, event_ids)),
+        ('load_events_all_stats by run', lambda: db.load_events_all_stats(session, event_ids, ['pop_id', 'pi', 'fis'])),
+        ('load_stats_aggregates phylum', lambda: db.load_stats_aggregates(session, unfiltered, 'all', 'phylum', db.DEFAULT_AGGREGATE_STATS)),
+        ('load_stats_aggregates country filtered', lambda: db.load_stats_aggregates(session, filtered, 'variant', 'country', db.DEFAULT_AGGREGATE_STATS)),
+        ('load_event_histogram rollup', lambda: db.load_event_histogram(session, bbox, 'month')),
+        ('load_event_histogram taxa', lambda: db.load_event_histogram(session, filtered, 'year')),
+        ('search_terms genus prefix', lambda: db.search_terms(session, GENERA[0][:3], 10)),
+        ('search_terms typo', lambda: db.search_terms(session, GENERA[0][:2] + GENERA[0][3:], 10)),
+        ('unique_phylum', lambda: db.unique_phylum.__wrapped__(session)),
+        ('unique_species', lambda: db.unique_species.__wrapped__(session)),
+        ('year_range', lambda: db.year_range.__wrapped__(session)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', action='append', help='only explain cases whose name starts with this; may be repeated')
+    parser.add_argument('--output', help='write the plans to this file instead of stdout')
+    args = parser.parse_args()
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    with SessionLocal() as session:
+        # Look up the optional views once, outside the captured statements
+        db.relation_exists(session, "event_summary")
+        db.relation_exists(session, "event_stacks_runs")
+        db.relation_exists(session, "search_terms")
+        db.relation_exists(session, "event_time_rollup")
+
+        for name, call in cases(session):
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            plans = []
+            with capture_plans(plans):
+                call()
+            for statement, plan in plans:
+                print(f"=== {name}\n{statement.strip()}\n", file=out)
+                print("\n".join(plan) + "\n", file=out)
+
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
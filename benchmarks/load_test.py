@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Drive the API with a mix of realistic requests and report latency per endpoint.
+
+Each worker thread picks a scenario at random by weight, fills in filters
+drawn from vocabulary.py (the values seed.py loads) and times the request.
+Responses are requested gzip compressed, as a browser would, and sizes are
+the bytes on the wire.
+
+Reports, per scenario: requests, errors, latency percentiles and mean
+response size, then the overall throughput. Use --json to save the results
+for comparison between runs.
+
+Usage: python3 benchmarks/load_test.py --url http://localhost:8000 [--duration 60] [--concurrency 8]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from vocabulary import *
+
+
+def _bbox(rng):
+    """A box around one of the point clouds, from street to continent scale"""
+    lng, lat = rng.choice(CENTRES)
+    width = rng.choice([0.5, 2, 10, 40])
+    return {
+        'min_lng': lng - width / 2, 'max_lng': lng + width / 2,
+        'min_lat': max(-85, lat - width / 4), 'max_lat': min(85, lat + width / 4),
+    }
+
+
+def _taxon_filters(rng):
+    filters = {}
+    if rng.random() < 0.5:
+        filters['phylum'] = ','.join(rng.sample(PHYLA, rng.randint(1, 3)))
+    if rng.random() < 0.3:
+        filters['genus'] = rng.choice(GENERA)
+    if rng.random() < 0.3:
+        filters['country'] = ','.join(rng.sample(COUNTRIES, rng.randint(1, 2)))
+    if rng.random() < 0.4:
+        start = rng.randint(*YEARS)
+        filters['min_year'], filters['max_year'] = start, min(YEARS[1], start + rng.randint(1, 20))
+    return filters
+
+
+def _filters(rng):
+    filters = _taxon_filters(rng)
+    if rng.random() < 0.7:
+        filters.update(_bbox(rng))
+    return filters
+
+
+def _tile(rng):
+    lng, lat = rng.choice(CENTRES)
+    z = rng.randint(2, 10)
+    n = 2 ** z
+    x = int((lng + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return z, min(x, n - 1), min(y, n - 1)
+
+
+# name: (weight, build(rng, event_ids) -> (method, path, query, body))
+SCENARIOS = {
+    'events': (20, lambda rng, ids: ('GET', '/events', {**_filters(rng), 'limit': 1000}, None)),
+    'events_all_fields': (5, lambda rng, ids: ('GET', '/events', {**_filters(rng), 'limit': 500, 'fields': 'all'}, None)),
+    'events_stream': (3, lambda rng, ids: ('GET', '/events', {**_filters(rng), 'stream': 'true'}, None)),
+    'events_columnar': (3, lambda rng, ids: ('GET', '/events', {**_filters(rng), 'limit': 1000, 'format': 'columnar'}, None)),
+    'events_clusters': (10, lambda rng, ids: ('GET', '/events', {**_taxon_filters(rng), 'zoom': rng.randint(1, 8)}, None)),
+    'events_facets': (8, lambda rng, ids: ('GET', '/events/facets', _filters(rng), None)),
+    'tiles': (15, lambda rng, ids: ('GET', '/events/tiles/{}/{}/{}.mvt'.format(*_tile(rng)), _taxon_filters(rng), None)),
+    'all_stats': (8, lambda rng, ids: ('GET', f'/events/{rng.choice(ids)}/all_stats', {}, None)),
+    'variant_stats': (8, lambda rng, ids: ('GET', f'/events/{rng.choice(ids)}/variant_stats', {}, None)),
+    'stats_aggregate': (3, lambda rng, ids: ('GET', '/events/stats/aggregate', {
+        **_filters(rng), 'group_by': rng.choice(['phylum', 'family', 'country']),
+    }, None)),
+    'stats_batch': (3, lambda rng, ids: ('POST', '/events/stats', {}, {'event_ids': rng.sample(ids, min(100, len(ids)))})),
+    'facet_lists': (15, lambda rng, ids: ('GET', rng.choice([
+        '/phylum', '/taxonomic_class', '/taxonomic_order', '/family', '/genus', '/species',
+        '/habitat', '/environmental_medium', '/establishment_means', '/years',
+    ]), {}, None)),
+    'histogram': (5, lambda rng, ids: ('GET', '/events/histogram', {
+        **_filters(rng), 'interval': rng.choice(['year', 'month']),
+    }, None)),
+    'search': (10, lambda rng, ids: ('GET', '/search', {
+        'q': rng.choice(GENERA + PHYLA + COUNTRIES)[:rng.randint(2, 6)],
+    }, None)),
+    'health': (2, lambda rng, ids: ('GET', '/health', {}, None)),
+}
+
+
+def request(base_url, method, path, query=None, body=None, timeout=60):
+    """Send one request. Returns (status, seconds, bytes received)."""
+    url = base_url.rstrip('/') + path
+    if query:
+        url += '?' + urllib.parse.urlencode(query)
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={
+        'Accept-Encoding': 'gzip',
+        **({'Content-Type': 'application/json'} if data is not None else {}),
+    })
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            size = len(response.read())
+            status = response.status
+    except urllib.error.HTTPError as e:
+        size = len(e.read())
+        status = e.code
+    except (urllib.error.URLError, TimeoutError):
+        size, status = 0, 0
+    return status, time.perf_counter() - started, size
+
+
+def sample_event_ids(base_url, n=1000):
+    """Event ids to request stats for, from the first page of /events"""
+    url = base_url.rstrip('/') + '/events?' + urllib.parse.urlencode({'fields': 'event_id', 'limit': n})
+    with urllib.request.urlopen(url, timeout=300) as response:
+        features = json.load(response)['features'] or []
+    return sorted({f['properties']['event_id'] for f in features})
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run for')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at once')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='only run this scenario; may be repeated')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    event_ids = sample_event_ids(args.url)
+    if not event_ids:
+        sys.exit("No events found; seed the database first with benchmarks/seed.py")
+
+    names = args.scenario or list(SCENARIOS)
+    weights = [SCENARIOS[name][0] for name in names]
+
+    results = defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(n):
+        rng = random.Random(args.seed + n)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, query, body = SCENARIOS[name][1](rng, event_ids)
+            outcome = request(args.url, method, path, query, body)
+            with lock:
+                results[name].append(outcome)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    print(f"{'scenario':<20}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'mean KB':>10}")
+    for name in names:
+        outcomes = results.get(name, [])
+        latencies = [seconds * 1000 for status, seconds, size in outcomes if 200 <= status < 400]
+        sizes = [size for status, seconds, size in outcomes if 200 <= status < 400]
+        report[name] = {
+            'requests': len(outcomes),
+            'errors': len(outcomes) - len(latencies),
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': max(latencies, default=float('nan')),
+            'mean_bytes': sum(sizes) / len(sizes) if sizes else float('nan'),
+        }
+        r = report[name]
+        print(f"{name:<20}{r['requests']:>9}{r['errors']:>8}{r['p50_ms']:>9.1f}{r['p90_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}{r['mean_bytes'] / 1024:>10.1f}")
+
+    total = sum(r['requests'] for r in report.values())
+    print(f"\n{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} requests/s at concurrency {args.concurrency}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'url': args.url,
+                'concurrency': args.concurrency,
+                'seconds': elapsed,
+                'requests_per_second': total / elapsed,
+                'scenarios': report,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Fill a local PostGIS database with synthetic data for benchmarking.
+
+Creates the tables from models.py and generates the rows inside Postgres
+with generate_series, so millions of rows load in minutes. Values are drawn
+from the small vocabularies in vocabulary.py with a fixed random seed, so
+a given scale always produces the same data. Then creates the indexes and
+materialized views, as `manage.py create-indexes create-views` would.
+
+Connects with the same PG* environment variables as the app. Start the
+database with `docker compose -f benchmarks/docker-compose.yml up -d`.
+
+Usage: python3 benchmarks/seed.py --events 100000 [--samples-per-event 3] [--reset]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from geoalchemy2 import Geometry
+from sqlalchemy import Connection, Integer
+from sqlalchemy.dialects.postgresql import NUMERIC
+from sqlalchemy.sql import text
+
+from database import engine
+from models import *
+from schema import create_indexes, create_rollups, create_tables, create_views
+from vocabulary import *
+
+
+# Tables in the order they are filled, parents before children
+TABLES = [
+    Batches, BioProjects, Datasets, EventMetadata, SampleMetadata, StacksRuns,
+    PopulationsSumStatsSummaryAllPositions, PopulationsSumStatsSummaryVariantPositions,
+]
+
+
+def _choice(values) -> str:
+    """SQL expression picking one of `values` at random"""
+    array = ', '.join("'" + v.replace("'", "''") + "'" for v in values)
+    return f"(ARRAY[{array}])[1 + floor(random() * {len(values)})::int]"
+
+
+def _filler(column) -> str:
+    """SQL expression for a column without an explicit value: random numbers, and text only where required"""
+    if isinstance(column.type, NUMERIC):
+        return "round(random()::numeric, 4)"
+    if isinstance(column.type, Integer):
+        return "floor(random() * 100)::int"
+    if isinstance(column.type, Geometry):
+        return "NULL"
+    return "NULL" if column.nullable else f"'{column.name}-' || i"
+
+
+def _insert(conn: Connection, model, count: int, values: dict, derived: dict):
+    """
+    Insert `count` rows for `model`, numbered by i from 0.
+
+    `values` maps attribute names to SQL expressions; other columns get a
+    filler. `derived` names expressions computed once per row, that several
+    values can refer to.
+    """
+    table = model.__table__
+    values = {model.__mapper__.columns[attr].name: sql for attr, sql in values.items()}
+    columns = [c for c in table.columns if c is not table.autoincrement_column or c.name in values]
+    expressions = [values.get(c.name, _filler(c)) for c in columns]
+    conn.execute(text(f"""
+        INSERT INTO {table.name} ({', '.join(f'"{c.name}"' for c in columns)})
+        SELECT {', '.join(expressions)}
+        FROM (
+            SELECT {', '.join(['i'] + [f'{sql} AS {name}' for name, sql in derived.items()])}
+            FROM generate_series(0, {count - 1}) AS i
+        ) AS series
+    """))
+
+
+def seed(conn: Connection, events: int, samples_per_event: int, events_per_dataset: int, runs_per_dataset: int):
+    datasets = max(1, events // events_per_dataset)
+    samples = events * samples_per_event
+    runs = datasets * runs_per_dataset
+    stats_rows = runs * POPULATIONS_PER_RUN
+
+    # Points cloud around a few centres so bounding boxes and tiles have realistic densities
+    centre_lng = f"(ARRAY{[c[0] for c in CENTRES]})[1 + i % {len(CENTRES)}]"
+    centre_lat = f"(ARRAY{[c[1] for c in CENTRES]})[1 + i % {len(CENTRES)}]"
+    point = {
+        'lng': f"round(greatest(-179.9, least(179.9, {centre_lng} + (random() - 0.5) * 40))::numeric, 6)",
+        'lat': f"round(greatest(-84.9, least(84.9, {centre_lat} + (random() - 0.5) * 30))::numeric, 6)",
+    }
+
+    rows = {
+        Batches: (datasets, {
+            'batch_name': "'batch-' || i",
+        }, {}),
+        BioProjects: (datasets, {
+            'bioproj_acc_id': "'PRJNA' || i",
+        }, {}),
+        Datasets: (datasets, {
+            'dataset_name': "'dataset-' || i",
+            'batch_name': "'batch-' || i",
+            'bioproj_acc_id': "'PRJNA' || i",
+            'r80': "'run-' || i || '-0'",
+        }, {}),
+        EventMetadata: (events, {
+            'event_id': "'event-' || lpad(i::text, 9, '0')",
+            'continent_ocean': _choice(CONTINENTS),
+            'country': _choice(COUNTRIES),
+            'decimal_latitude': "lat",
+            'decimal_longitude': "lng",
+            'environmental_medium': _choice(MEDIA),
+            'habitat': _choice(HABITATS),
+            'locality': "'locality-' || (i % 1000)",
+            'year_collected': f"{YEARS[0]} + floor(random() * {YEARS[1] - YEARS[0] + 1})::int",
+            'month_collected': "1 + floor(random() * 12)::int",
+            'day_collected': "1 + floor(random() * 28)::int",
+            'geom': f"ST_SetSRID(ST_MakePoint(lng, lat), {SRID})",
+        }, point),
+        SampleMetadata: (samples, {
+            'sample_bcid': "'sample-' || lpad(i::text, 10, '0')",
+            'event_id': f"'event-' || lpad((i / {samples_per_event})::text, 9, '0')",
+            'dataset_name': f"'dataset-' || ((i / {samples_per_event}) / {events_per_dataset}) % {datasets}",
+            'taxonomic_class': _choice(CLASSES),
+            'colloquial_name': "'common name ' || (i % 500)",
+            'establishment_means': _choice(ESTABLISHMENT_MEANS),
+            'family': _choice(FAMILIES),
+            'genus': _choice(GENERA),
+            'phylum': _choice(PHYLA),
+            'specific_epithet': _choice(SPECIES),
+            'taxonomic_order': _choice(ORDERS),
+        }, {}),
+        StacksRuns: (runs, {
+            'stacks_run_id': "i + 1",
+            'stacks_run_name': f"'run-' || (i / {runs_per_dataset}) || '-' || (i % {runs_per_dataset})",
+            'dataset_name': f"'dataset-' || (i / {runs_per_dataset})",
+        }, {}),
+        PopulationsSumStatsSummaryAllPositions: (stats_rows, {
+            'stacks_run_id': f"1 + i / {POPULATIONS_PER_RUN}",
+            'pop_id': f"'pop' || (1 + i % {POPULATIONS_PER_RUN})",
+        }, {}),
+        PopulationsSumStatsSummaryVariantPositions: (stats_rows, {
+            'stacks_run_id': f"1 + i / {POPULATIONS_PER_RUN}",
+            'pop_id': f"'pop' || (1 + i % {POPULATIONS_PER_RUN})",
+        }, {}),
+    }
+
+    conn.execute(text("SELECT setseed(0.42)"))
+    for model in TABLES:
+        count, values, derived = rows[model]
+        started = time.perf_counter()
+        _insert(conn, model, count, values, derived)
+        print(f"{model.__tablename__:<50}{count:>12,} rows {time.perf_counter() - started:>8.1f}s")
+
+
+def reset(conn: Connection):
+    conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS event_summary"))
+    conn.execute(text("DROP TABLE IF EXISTS event_time_rollup"))
+    for model in reversed(TABLES):
+        conn.execute(text(f"DROP TABLE IF EXISTS {model.__tablename__} CASCADE"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=10000, help='rows in event_metadata')
+    parser.add_argument('--samples-per-event', type=int, default=3, help='sample_metadata rows per event')
+    parser.add_argument('--events-per-dataset', type=int, default=200)
+    parser.add_argument('--runs-per-dataset', type=int, default=3, help='stacks_runs per dataset, the first named by datasets.r80')
+    parser.add_argument('--reset', action='store_true', help='drop the tables and views before seeding')
+    args = parser.parse_args()
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgis"))
+        if args.reset:
+            reset(conn)
+        create_tables(conn)
+        seed(conn, args.events, args.samples_per_event, args.events_per_dataset, args.runs_per_dataset)
+
+    with engine.begin() as conn:
+        create_indexes(conn)
+        create_views(conn)
+        create_rollups(conn)
+        conn.execute(text("ANALYZE"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Compare the CPU cost of encoding large /events and stats responses.
+
+Runs without a database on synthetic rows shaped like the real ones:
+
+  old   Postgres JSON decoded by psycopg, walked by jsonable_encoder, then
+        encoded again by the stdlib json module (the previous code path)
+  new   /events: the JSON text from Postgres sent as is
+        stats:   rows encoded once with orjson
+
+Usage: python3 benchmarks/serialization.py [--events 10000] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from responses import FastJSONResponse
+
+
+def make_features(n):
+    features = []
+    for i in range(n):
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [random.uniform(-180, 180), random.uniform(-90, 90)]},
+            'properties': {
+                'event_id': f'event-{i:08d}',
+                'phylum': random.choice(['Arthropoda', 'Chordata', 'Mollusca', 'Cnidaria']),
+                'class': random.choice(['Insecta', 'Actinopteri', 'Gastropoda', 'Anthozoa']),
+                'taxonomic_order': 'Diptera',
+                'family': 'Culicidae',
+                'genus': 'Aedes',
+                'specific_epithet': 'aegypti',
+                'colloquial_name': 'yellow fever mosquito',
+                'country': 'Brazil',
+                'year_collected': random.randint(1950, 2023),
+            },
+        })
+    return features
+
+
+def make_stats(n):
+    return [
+        {
+            'event_id': f'event-{i // 10:08d}',
+            'pop_id': f'pop-{i}',
+            'num_indv': Decimal(random.randint(1, 200)),
+            'p': Decimal(f'{random.random():.6f}'),
+            'obs_het': Decimal(f'{random.random():.6f}'),
+            'exp_het': Decimal(f'{random.random():.6f}'),
+            'pi': Decimal(f'{random.random():.6f}'),
+            'fis': Decimal(f'{random.uniform(-1, 1):.6f}'),
+        }
+        for i in range(n)
+    ]
+
+
+def cpu_time(fn, repeat):
+    """Best process time of `repeat` runs, in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        best = min(best, time.process_time() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=10000, help='features in the /events response')
+    parser.add_argument('--stats', type=int, default=50000, help='rows in the stats response')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # What Postgres sends for json_agg / string_agg
+    features_text = json.dumps(make_features(args.events))
+
+    def events_old():
+        features = json.loads(features_text)
+        return JSONResponse(content=jsonable_encoder({'type': 'FeatureCollection', 'features': features, 'next': None}))
+
+    def events_new():
+        # As /events does, passing the JSON text through
+        body = '{"type": "FeatureCollection", "features": ' + features_text + ', "next": null}'
+        return Response(body.encode(), media_type="application/json")
+
+    stats = make_stats(args.stats)
+
+    def stats_old():
+        return JSONResponse(content=jsonable_encoder(stats))
+
+    def stats_new():
+        return FastJSONResponse(stats)
+
+    print(f"{'response':<28}{'old ms':>10}{'new ms':>10}{'saved':>8}")
+    for name, old, new in [
+        (f'/events, {args.events} features', events_old, events_new),
+        (f'stats, {args.stats} rows', stats_old, stats_new),
+    ]:
+        old_ms = cpu_time(old, args.repeat)
+        new_ms = cpu_time(new, args.repeat)
+        print(f"{name:<28}{old_ms:>10.1f}{new_ms:>10.1f}{1 - new_ms / old_ms:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
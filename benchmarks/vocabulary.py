@@ -0,0 +1,21 @@
+"""Values the synthetic benchmark data is drawn from, shared by seed.py and load_test.py"""
+
+PHYLA = ['Arthropoda', 'Chordata', 'Mollusca', 'Cnidaria', 'Echinodermata', 'Annelida', 'Porifera']
+CLASSES = ['Insecta', 'Actinopteri', 'Gastropoda', 'Anthozoa', 'Malacostraca', 'Bivalvia', 'Polychaeta', 'Aves']
+ORDERS = ['Diptera', 'Perciformes', 'Decapoda', 'Scleractinia', 'Lepidoptera', 'Coleoptera', 'Littorinimorpha']
+FAMILIES = ['Culicidae', 'Pomacentridae', 'Portunidae', 'Acroporidae', 'Nymphalidae', 'Carabidae', 'Conidae']
+GENERA = ['Aedes', 'Amphiprion', 'Callinectes', 'Acropora', 'Heliconius', 'Carabus', 'Conus', 'Anopheles']
+SPECIES = ['aegypti', 'ocellaris', 'sapidus', 'millepora', 'melpomene', 'nemoralis', 'geographus', 'gambiae']
+COUNTRIES = ['USA', 'Brazil', 'Australia', 'Indonesia', 'Philippines', 'Mexico', 'Kenya', 'Japan', 'Fiji', 'Canada']
+CONTINENTS = ['North America', 'South America', 'Oceania', 'Asia', 'Africa', 'Pacific Ocean', 'Atlantic Ocean']
+HABITATS = ['coral reef', 'mangrove', 'rocky intertidal', 'forest', 'freshwater stream', 'seagrass bed']
+MEDIA = ['sea water', 'soil', 'fresh water', 'sediment', 'plant tissue']
+ESTABLISHMENT_MEANS = ['native', 'introduced', 'invasive', 'uncertain']
+
+# Populations per stacks run, each with a row in both summary stats tables
+POPULATIONS_PER_RUN = 5
+
+# Centres of the clouds of event points, as (longitude, latitude)
+CENTRES = [(-80, 25), (-45, -15), (150, -25), (120, 5), (178, -18), (36, -1), (139, 36), (-100, 45)]
+
+YEARS = (1950, 2023)
@@ -0,0 +1,54 @@
+"""
+Shared setup for the API tests.
+
+The tests run without a database: endpoints get a session whose run_sync
+calls the helper with a stand-in for the synchronous session, and tests
+replace the db helpers they exercise with monkeypatch.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('PGUSER', 'geode')
+os.environ.setdefault('PGPASS', 'geode')
+os.environ.setdefault('PGHOST', 'localhost')
+os.environ.setdefault('PGDATABASE', 'geode')
+os.environ['WARM_UP'] = 'false'
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from fastapi.testclient import TestClient
+
+import main
+from cache import events_cache, facet_cache
+
+
+class FakeSession:
+    """Async session stand-in: run_sync calls the helper with `sync_session`"""
+
+    def __init__(self, sync_session=None):
+        self.sync_session = sync_session
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return fn(self.sync_session, *args, **kwargs)
+
+
+@pytest.fixture
+def session():
+    return FakeSession()
+
+
+@pytest.fixture
+def client(session):
+    async def get_session():
+        yield session
+
+    main.app.dependency_overrides[main.get_read_db] = get_session
+    asyncio.run(events_cache.clear())
+    facet_cache.invalidate()
+    with TestClient(main.app) as client:
+        yield client
+    main.app.dependency_overrides.clear()
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import cache
+import main
+
+
+class UnreachableRedis:
+    """Stands in for a Redis client whose server is down"""
+
+    async def get(self, key):
+        raise cache.RedisError("Connection refused")
+
+    async def set(self, key, value, ex=None):
+        raise cache.RedisError("Connection refused")
+
+
+def test_redis_cache_fails_open():
+    pytest.importorskip('redis')
+    redis_cache = cache.RedisCache('redis://localhost:1', ttl=60, prefix='test')
+    redis_cache.client = UnreachableRedis()
+
+    assert asyncio.run(redis_cache.get('key')) is None
+    asyncio.run(redis_cache.set('key', b'value'))
+
+
+class CounterRedis:
+    """Stands in for a Redis client holding one counter, shared by the workers given it"""
+
+    def __init__(self):
+        self.value = None
+
+    async def get(self, key):
+        return None if self.value is None else str(self.value).encode()
+
+    async def incr(self, key):
+        self.value = (self.value or 0) + 1
+        return self.value
+
+
+def test_shared_generation_invalidates_every_worker():
+    pytest.importorskip('redis')
+    redis_client = CounterRedis()
+    workers = []
+    for _ in range(2):
+        facet_cache = cache.TTLCache(ttl=3600)
+        generation = cache.SharedGeneration('redis://localhost:1', 'test', facet_cache, interval=0)
+        generation.client = redis_client
+        asyncio.run(generation.check())
+        facet_cache.set('phylum', ['Chordata'])
+        workers.append((facet_cache, generation))
+
+    (cache_a, generation_a), (cache_b, generation_b) = workers
+    asyncio.run(generation_a.bump())
+    assert cache_a.get('phylum') is None
+
+    asyncio.run(generation_b.check())
+    assert cache_b.get('phylum') is None
+
+    # The counter has not moved since, so refilled values are kept
+    cache_b.set('phylum', ['Chordata'])
+    asyncio.run(generation_b.check())
+    assert cache_b.get('phylum') is not None
+
+
+class DownRedis(UnreachableRedis):
+    async def incr(self, key):
+        raise cache.RedisError("Connection refused")
+
+    async def scan_iter(self, match=None, count=None):
+        raise cache.RedisError("Connection refused")
+        yield
+
+
+def test_invalidate_reports_unreachable_redis(client, monkeypatch):
+    pytest.importorskip('redis')
+    redis_cache = cache.RedisCache('redis://localhost:1', ttl=60, prefix='test')
+    redis_cache.client = DownRedis()
+    generation = cache.SharedGeneration('redis://localhost:1', 'test', cache.facet_cache)
+    generation.client = DownRedis()
+    monkeypatch.setattr(main, 'events_cache', redis_cache)
+    monkeypatch.setattr(main, 'facet_generation', generation)
+    monkeypatch.setenv('CACHE_ADMIN_TOKEN', 'secret')
+
+    response = client.post('/cache/invalidate', headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200
+    assert response.json() == {'facets': False, 'events': False}
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+import db
+import main
+from filters import EventFilters
+
+
+def _fake_page(db, filters, limit, after, fields=None):
+    return ['e1']
+
+def _fake_events(db, filters, fields, event_ids, as_text=False):
+    if as_text:
+        return [('[{"type": "Feature", "properties": {"event_id": "e1"}, "geometry": null}]',)]
+    return [([{"type": "Feature", "properties": {"event_id": "e1"}, "geometry": None}],)]
+
+def _fake_clusters(db, filters, zoom, breakdown, as_text=False):
+    return [('[]',)]
+
+
+def test_stream_with_zoom_returns_cached_clusters(client, monkeypatch):
+    monkeypatch.setattr(main, 'load_event_clusters', _fake_clusters)
+
+    response = client.get('/events', params={'stream': 'true', 'zoom': 3})
+    assert response.status_code == 200
+    assert response.json() == {'type': 'FeatureCollection', 'features': []}
+    assert response.headers['x-cache'] == 'miss'
+
+    assert client.get('/events', params={'stream': 'true', 'zoom': 3}).headers['x-cache'] == 'hit'
+
+
+# Stands in for event_metadata: one event inside the box the tests ask for, one just outside
+POINTS = {'inside': (10.02, 20.02), 'outside': (10.005, 20.02)}
+
+def _in_bbox(filters):
+    return [
+        event_id for event_id, (lng, lat) in POINTS.items()
+        if filters.min_lng <= lng <= filters.max_lng and filters.min_lat <= lat <= filters.max_lat
+    ]
+
+def _page_in_bbox(db, filters, limit, after, fields=None):
+    return _in_bbox(filters)
+
+def _events_in_bbox(db, filters, fields, event_ids, as_text=False):
+    features = [
+        {"type": "Feature", "properties": {"event_id": event_id}, "geometry": None}
+        for event_id in _in_bbox(filters) if event_id in event_ids
+    ]
+    return [(json.dumps(features),)] if as_text else [(features,)]
+
+
+def test_point_outside_bbox_is_not_returned(client, monkeypatch):
+    monkeypatch.setattr(main, 'load_event_page', _page_in_bbox)
+    monkeypatch.setattr(main, 'load_events', _events_in_bbox)
+
+    bbox = {'min_lng': 10.01, 'min_lat': 20.01, 'max_lng': 10.03, 'max_lat': 20.03}
+    response = client.get('/events', params=bbox)
+    assert [f['properties']['event_id'] for f in response.json()['features']] == ['inside']
+
+
+def test_all_fields_is_cached(client, monkeypatch):
+    monkeypatch.setattr(main, 'load_event_page', _fake_page)
+    monkeypatch.setattr(main, 'load_events', _fake_events)
+
+    response = client.get('/events', params={'fields': 'all', 'limit': 10})
+    assert response.status_code == 200
+    assert response.json()['features'][0]['properties'] == {'event_id': 'e1'}
+    assert response.headers['x-cache'] == 'miss'
+
+    assert client.get('/events', params={'fields': 'all', 'limit': 10}).headers['x-cache'] == 'hit'
+
+
+class RecordingSession:
+    """Stands in for a sync session, keeping the statements it is given"""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(str(statement))
+        return Result()
+
+
+class Result:
+    def scalars(self):
+        return []
+
+
+@pytest.mark.parametrize('fields, summary', [
+    (None, False),
+    (['event_id', 'phylum'], True),
+    (['event_id', 'sample_bcid', 'locality', 'principal_investigator'], False),
+])
+def test_event_page_reads_where_load_events_does(monkeypatch, fields, summary):
+    monkeypatch.setattr(db, 'relation_exists', lambda session, name: True)
+    session = RecordingSession()
+
+    db.load_event_page(session, EventFilters.create(), 10, None, fields)
+    assert ('event_summary' in session.statements[0]) is summary
+    assert db._use_summary(session, fields) is summary
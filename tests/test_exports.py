@@ -0,0 +1,30 @@
+import threading
+
+import exports
+
+
+def test_export_files_are_handled_off_the_event_loop(client, monkeypatch, tmp_path):
+    threads = {}
+
+    def record(name, result=None):
+        def fn(*args):
+            threads[name] = threading.current_thread()
+            return result
+        return fn
+
+    async def start_job(job):
+        threads['event loop'] = threading.current_thread()
+
+    job = {'id': 'a' * 32, 'status': 'queued'}
+    monkeypatch.setattr(exports, 'remove_expired_jobs', record('remove_expired_jobs'))
+    monkeypatch.setattr(exports, 'running_jobs', record('running_jobs', 0))
+    monkeypatch.setattr(exports, 'create_job', record('create_job', job))
+    monkeypatch.setattr(exports, 'start_job', start_job)
+    monkeypatch.setattr(exports, 'read_job', record('read_job', job))
+
+    assert client.post('/exports').status_code == 202
+    assert client.get(f"/exports/{job['id']}").status_code == 200
+
+    loop = threads.pop('event loop')
+    assert set(threads) == {'remove_expired_jobs', 'running_jobs', 'create_job', 'read_job'}
+    assert all(thread is not loop for thread in threads.values())
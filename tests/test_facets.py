@@ -0,0 +1,27 @@
+import pytest
+
+import main
+from cache import TTLCache
+
+
+@pytest.fixture
+def phylum(monkeypatch):
+    @TTLCache(ttl=60).cached
+    def unique_phylum(db):
+        return ['Chordata']
+
+    monkeypatch.setattr(main, 'unique_phylum', unique_phylum)
+
+
+@pytest.mark.parametrize('if_none_match', ['{etag}', 'W/{etag}', '"other", W/{etag}', '*'])
+def test_matching_etag_is_not_modified(client, phylum, if_none_match):
+    etag = client.get('/phylum').headers['etag']
+
+    response = client.get('/phylum', headers={'If-None-Match': if_none_match.format(etag=etag)})
+    assert response.status_code == 304
+
+
+def test_other_etag_is_modified(client, phylum):
+    response = client.get('/phylum', headers={'If-None-Match': 'W/"other"'})
+    assert response.status_code == 200
+    assert response.json() == ['Chordata']
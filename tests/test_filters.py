@@ -0,0 +1,32 @@
+from sqlalchemy.dialects import postgresql
+
+import db
+from filters import EVENT_FIELDS, EventFilters, events_query
+from models import EventMetadata, SampleMetadata
+
+
+def _names(table, *skip):
+    return {column.name for column in table.columns if column.name not in skip}
+
+
+def test_event_fields_keep_both_principal_investigators():
+    expected = _names(EventMetadata.__table__, 'geom') \
+        | _names(SampleMetadata.__table__, 'event_id', 'principal_investigator') \
+        | {'sample_metadata.principal_investigator'}
+
+    assert EVENT_FIELDS.keys() == expected
+    assert EVENT_FIELDS['principal_investigator'] is EventMetadata.__table__.c.principal_investigator
+    assert EVENT_FIELDS['sample_metadata.principal_investigator'] is SampleMetadata.__table__.c.principal_investigator
+
+
+def test_stats_fields_list_join_columns_once():
+    assert {'event_id', 'dataset_name', 'stacks_run_id', 'sample_metadata.principal_investigator'} <= db.ALL_STATS_FIELDS.keys()
+    assert not [name for name in db.ALL_STATS_FIELDS if name.endswith(('.event_id', '.dataset_name', '.stacks_run_id'))]
+
+
+def test_duplicate_names_are_selected_under_their_field_name():
+    query = events_query(EventFilters.create().shape, fields=('principal_investigator', 'sample_metadata.principal_investigator'))
+    sql = str(query.compile(dialect=postgresql.dialect()))
+
+    assert 'event_metadata.principal_investigator AS principal_investigator' in sql
+    assert 'sample_metadata.principal_investigator AS "sample_metadata.principal_investigator"' in sql
@@ -0,0 +1,15 @@
+import pytest
+
+import formats
+
+
+@pytest.mark.parametrize('accept, format', [
+    (None, formats.GEOJSON),
+    ('application/json', formats.GEOJSON),
+    ('application/vnd.geode.columnar+json', formats.COLUMNAR),
+    ('application/geo+json;q=0.5, application/vnd.geode.columnar+json', formats.COLUMNAR),
+    ('application/vnd.apache.parquet;q=0.9, application/vnd.apache.arrow.stream', formats.ARROW),
+    ('text/html', formats.GEOJSON),
+])
+def test_negotiate(accept, format):
+    assert formats.negotiate(accept) == format
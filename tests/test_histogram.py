@@ -0,0 +1,22 @@
+import pytest
+
+import db
+from filters import EventFilters
+
+
+@pytest.fixture
+def rollup_exists(monkeypatch):
+    monkeypatch.setattr(db, 'relation_exists', lambda session, name: True)
+
+
+@pytest.mark.parametrize('filters, rollup', [
+    (EventFilters.create(), True),
+    (EventFilters.create(country=['Canada'], min_year=2000), True),
+    (EventFilters.create(min_lng=-80, min_lat=40, max_lng=-70, max_lat=50), True),
+    # Cells cut by the box would be counted whole, inflating the counts
+    (EventFilters.create(min_lng=-79.5, min_lat=40, max_lng=-70, max_lat=50), False),
+    (EventFilters.create(min_lng=-80, min_lat=40, max_lng=-70, max_lat=49.9), False),
+    (EventFilters.create(phylum=['Chordata']), False),
+])
+def test_rollup_only_for_cell_aligned_filters(session, rollup_exists, filters, rollup):
+    assert db._use_rollup(session, filters) is rollup
@@ -0,0 +1,50 @@
+import asyncio
+
+from replicas import Replica, ReplicaRouter
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeConnection:
+    def __init__(self, lag):
+        self.lag = lag
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        return FakeResult(self.lag)
+
+
+class FakeEngine:
+    def __init__(self, lag=0):
+        self.lag = lag
+
+    def connect(self):
+        return FakeConnection(self.lag)
+
+
+def test_replicas_are_used_only_once_checked():
+    primary, replica_engine = FakeEngine(), FakeEngine(lag=1)
+    router = ReplicaRouter(primary, [Replica('replica', replica_engine)])
+    assert router.choose() is primary
+
+    asyncio.run(router.check(router.replicas[0]))
+    assert router.choose() is replica_engine
+
+
+def test_lagging_replica_is_skipped():
+    primary = FakeEngine()
+    router = ReplicaRouter(primary, [Replica('replica', FakeEngine(lag=120))], max_lag=30)
+
+    asyncio.run(router.check(router.replicas[0]))
+    assert router.choose() is primary
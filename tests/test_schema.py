@@ -0,0 +1,37 @@
+import pytest
+
+import schema
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeConnection:
+    """Answers Find_SRID with `srid` and records the other statements"""
+
+    def __init__(self, srid):
+        self.srid = srid
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+        return FakeResult(self.srid)
+
+
+@pytest.mark.parametrize('srid', [0, 3857])
+def test_create_indexes_fails_on_other_srid(srid):
+    conn = FakeConnection(srid)
+    with pytest.raises(RuntimeError, match=f"SRID {srid}"):
+        schema.create_indexes(conn)
+    assert len(conn.statements) == 1
+
+
+def test_create_indexes_with_expected_srid():
+    conn = FakeConnection(schema.SRID)
+    schema.create_indexes(conn)
+    assert len(conn.statements) == 1 + len(schema.INDEXES) + len(schema.ANALYZE_TABLES)
@@ -0,0 +1,115 @@
+from collections import namedtuple
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import db
+import main
+from models import Datasets, EventMetadata, PopulationsSumStatsSummaryAllPositions, SampleMetadata, StacksRuns
+from schema import EVENT_STACKS_RUNS
+
+
+def _create(session, table, rows):
+    """An untyped copy of `table`, which SQLite accepts whatever the column types"""
+    columns = ", ".join(f'"{column.name}"' for column in table.columns)
+    session.execute(text(f"CREATE TABLE {table.name} ({columns})"))
+    for row in rows:
+        session.execute(text(
+            f"INSERT INTO {table.name} ({', '.join(row)}) VALUES ({', '.join(':' + name for name in row)})"
+        ), row)
+
+
+@pytest.fixture
+def stats_db():
+    with Session(create_engine("sqlite://")) as session:
+        _create(session, EventMetadata.__table__, [
+            {'event_id': 'e1', 'country': 'Canada'},
+            {'event_id': 'e2', 'country': 'Chile'},
+        ])
+        _create(session, SampleMetadata.__table__, [
+            {'sample_bcid': 's1', 'event_id': 'e1', 'dataset_name': 'd1'},
+            {'sample_bcid': 's2', 'event_id': 'e1', 'dataset_name': 'd1'},
+            {'sample_bcid': 's3', 'event_id': 'e1', 'dataset_name': 'd2'},
+            {'sample_bcid': 's4', 'event_id': 'e2', 'dataset_name': 'd2'},
+        ])
+        _create(session, Datasets.__table__, [
+            {'dataset_name': 'd1', 'r80': 'r80_d1'},
+            {'dataset_name': 'd2', 'r80': 'r80_d2'},
+        ])
+        _create(session, StacksRuns.__table__, [
+            {'stacks_run_id': 1, 'stacks_run_name': 'r80_d1', 'dataset_name': 'd1'},
+            {'stacks_run_id': 2, 'stacks_run_name': 'other', 'dataset_name': 'd1'},
+            {'stacks_run_id': 3, 'stacks_run_name': 'r80_d2', 'dataset_name': 'd2'},
+        ])
+        _create(session, PopulationsSumStatsSummaryAllPositions.__table__, [
+            {'stacks_run_id': 1, 'pop_id': 'p1'},
+            {'stacks_run_id': 1, 'pop_id': 'p2'},
+            {'stacks_run_id': 2, 'pop_id': 'p3'},
+            {'stacks_run_id': 3, 'pop_id': 'p4'},
+        ])
+        view = EVENT_STACKS_RUNS.split(" AS", 1)[1]
+        session.execute(text(f"CREATE TABLE event_stacks_runs AS {view}"))
+        yield session
+
+
+def _rows(session, monkeypatch, by_run: bool, fields=None):
+    monkeypatch.setattr(db, 'relation_exists', lambda session, name: by_run)
+    return sorted(tuple(row._mapping.items()) for row in db.load_event_all_stats(session, 'e1', fields))
+
+
+def test_stats_through_event_stacks_runs_match_r80_join(stats_db, monkeypatch):
+    by_name = _rows(stats_db, monkeypatch, by_run=False)
+    by_run = _rows(stats_db, monkeypatch, by_run=True)
+    assert db._stats_source(stats_db, 'all', None)[0] is db.ALL_STATS_FULL_RUN_FROM
+
+    assert by_run == by_name
+    # s1 and s2 with the two populations of d1's r80 run, s3 with the one of d2's
+    assert len(by_run) == 5
+    assert {dict(row)['pop_id'] for row in by_run} == {'p1', 'p2', 'p4'}
+
+
+def test_stats_of_run_fields_keep_a_row_per_sample(stats_db, monkeypatch):
+    fields = ['stacks_run_id', 'pop_id']
+    by_name = _rows(stats_db, monkeypatch, False, fields)
+    by_run = _rows(stats_db, monkeypatch, True, fields)
+    assert db._stats_source(stats_db, 'all', fields)[0] is db.ALL_STATS_RUN_FROM
+
+    assert by_run == by_name
+    assert len(by_run) == len(_rows(stats_db, monkeypatch, True)) == 5
+
+
+def test_event_id_only_returned_when_requested(monkeypatch):
+    Stats = namedtuple('Stats', ['event_id', 'pop_id'])
+    session = SimpleNamespace(execute=lambda statement, params: [Stats('e1', 'p1'), Stats('e1', 'p2')])
+    monkeypatch.setattr(db, 'relation_exists', lambda session, name: False)
+
+    assert db.load_events_all_stats(session, ['e1'], ['pop_id']) == {'e1': [{'pop_id': 'p1'}, {'pop_id': 'p2'}]}
+    assert db.load_events_all_stats(session, ['e1'], ['pop_id', 'event_id'])['e1'][0] == {'event_id': 'e1', 'pop_id': 'p1'}
+
+
+def test_stats_fields_checked_against_each_kind(client, monkeypatch):
+    requested = {}
+
+    def fake_loader(kind):
+        def load(session, event_ids, fields):
+            requested[kind] = fields
+            return {event_id: [{'pop_id': 'p1'}] for event_id in event_ids}
+        return load
+
+    monkeypatch.setattr(main, 'load_events_all_stats', fake_loader('all'))
+    monkeypatch.setattr(main, 'load_events_variant_stats', fake_loader('variant'))
+
+    # sites is only in the all-positions stats
+    response = client.post('/events/stats', params={'fields': 'pop_id,sites'}, json={'event_ids': ['e1']})
+    assert response.status_code == 200
+    assert requested == {'all': ['pop_id', 'sites'], 'variant': ['pop_id']}
+
+    requested.clear()
+    response = client.post('/events/stats', params={'fields': 'sites'}, json={'event_ids': ['e1']})
+    assert requested == {'all': ['sites']}
+    assert response.json() == {'e1': {'all_stats': [{'pop_id': 'p1'}]}}
+
+    response = client.post('/events/stats', params={'fields': 'sites'}, json={'event_ids': ['e1'], 'stats': ['variant']})
+    assert response.status_code == 400
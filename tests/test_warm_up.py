@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeEngine:
+    """Hands out connections, failing every `fail_every`th attempt"""
+
+    def __init__(self, fail_every):
+        self.fail_every = fail_every
+        self.attempts = 0
+        self.connections = []
+
+    async def connect(self):
+        self.attempts += 1
+        if self.attempts % self.fail_every == 0:
+            raise ConnectionError("Connection refused")
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+
+def test_failed_warm_up_closes_opened_connections(monkeypatch):
+    engine = FakeEngine(fail_every=3)
+    monkeypatch.setattr(main.read_router, 'engines', lambda: [engine])
+    app = SimpleNamespace(state=SimpleNamespace(ready=False))
+
+    asyncio.run(main.warm_up(app))
+
+    assert engine.connections and all(connection.closed for connection in engine.connections)
+    assert app.state.ready